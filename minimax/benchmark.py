@@ -0,0 +1,219 @@
+import argparse
+import json
+import platform
+import random
+import sys
+import player as players
+
+from datetime import datetime, timezone
+from time import perf_counter, time
+from chess import Board
+from chess_game import ChessGame
+
+try:
+    from config import BOARD_SCORES
+except ModuleNotFoundError:
+    from .config import BOARD_SCORES
+
+# fixed positions, searched from an empty move stack with cleared transposition table and evaluation cache
+POSITIONS = {
+    "opening": [
+        "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1",
+        "r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3",
+        "rnbqkb1r/pp2pppp/3p1n2/8/3NP3/8/PPP2PPP/RNBQKB1R w KQkq - 1 5",
+    ],
+    "middlegame": [
+        "r2q1rk1/ppp2ppp/2np1n2/2b1p1B1/2B1P1b1/2NP1N2/PPP2PPP/R2Q1RK1 w - - 0 8",
+        "r1bq1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N1PN2/PP1QBPPP/R3KB1R w KQ - 0 9",
+        "2rq1rk1/pb1nbppp/1p2pn2/2pp4/2PP4/1PNBPN2/PB1Q1PPP/2R2RK1 w - - 0 12",
+    ],
+    "endgame": [
+        "8/5pk1/6p1/8/3R4/6P1/5PK1/3r4 w - - 0 40",
+        "8/8/4k3/3p4/3P4/4K3/8/8 w - - 0 50",
+        "6k1/5ppp/8/8/8/8/1Q3PPP/6K1 w - - 0 35",
+    ],
+}
+
+PLAYERS = ["MiniMaxPlayer", "MiniMaxPlayerWithRegressor", "MiniMaxPlayerWithHFunction",
+           "MiniMaxPlayerWithHFunctionPrediction"]
+
+# static evaluators of ChessGame timed by the evals micro-benchmark, all take (board, player, board_scores_policy)
+EVALUATORS = ["eval_board_state", "eval_board_state_material_control", "eval_board_state_position",
+              "eval_board_state_mobility", "h_features"]
+
+# a regression is a relative change beyond the threshold in the wrong direction, node counts are
+# deterministic and compared per position, timings are compared on the totals of a player and depth
+POSITION_METRICS = {"nodes": 1}
+TOTAL_METRICS = {"time": 1, "nps": -1}
+
+
+def run(player_names: list=PLAYERS, depths: list=(2, 3), positions: dict=POSITIONS, seed: int=0,
+        repeat: int=3, verbose: bool=True, options: dict=None) -> dict:
+    """Searches every position with every player and depth, keeping the fastest of repeat searches.
+
+    options are search options passed to every player, like pvs=True or aspiration_window=0.5.
+    """
+    options = options or {}
+    results = []
+    for name in player_names:
+        for depth in depths:
+            bot = getattr(players, name)(True, depth=depth, **options)
+            for phase, fens in positions.items():
+                for fen in fens:
+                    board = Board(fen)
+                    bot.player = board.turn
+                    elapsed = None
+                    for _ in range(repeat):
+                        if bot.tt is not None:
+                            bot.tt.clear()
+                        if bot.game.cache is not None:
+                            bot.game.cache.clear()
+                        # the evaluations add random noise, seed it so every search visits the same tree
+                        random.seed(seed)
+
+                        start_time = time()
+                        bot.engine.search(board, depth)
+                        search_time = time() - start_time
+                        if elapsed is None or search_time < elapsed:
+                            elapsed, stats = search_time, bot.engine.stats.as_dict()
+
+                    results.append(dict(stats, player=name, depth=depth, phase=phase, fen=fen,
+                                        time=round(elapsed, 4)))
+                    if verbose:
+                        print(f"{name:<38} d{depth} {phase:<10} {stats['move']:<6} nodes {stats['nodes']:>8} "
+                              f"nps {stats['nps']:>7} time {elapsed:>8.3f}s")
+            bot.end_game()
+
+    return {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "machine": platform.machine(),
+        "seed": seed,
+        "repeat": repeat,
+        "options": options,
+        "results": results,
+    }
+
+
+def eval_speed(evaluators: list=EVALUATORS, positions: dict=POSITIONS, rounds: int=2000,
+               verbose: bool=True) -> dict:
+    """Evaluations per second of each evaluator, over every position from both sides, uncached."""
+    game = ChessGame()
+    boards = [Board(fen) for fens in positions.values() for fen in fens]
+    speeds = {}
+    for name in evaluators:
+        evaluate = getattr(game, name)
+        start = perf_counter()
+        for _ in range(rounds):
+            for board in boards:
+                evaluate(board, True, BOARD_SCORES)
+                evaluate(board, False, BOARD_SCORES)
+        speeds[name] = round(rounds * len(boards) * 2 / (perf_counter() - start))
+        if verbose:
+            print(f"{name:<38} {speeds[name]:>9} evals/s")
+
+    return speeds
+
+
+def compare(base: dict, new: dict, threshold: float=0.1) -> tuple:
+    """Compares the positions present in both runs.
+
+    Returns a line per regression of new against base, and a line per
+    position where the chosen move changed.
+    """
+    def by_position(run):
+        return {(r["player"], r["depth"], r["fen"]): r for r in run["results"]}
+
+    def regressed(label, old, current, metrics):
+        for metric, direction in metrics.items():
+            if old[metric]:
+                change = (current[metric] - old[metric]) / old[metric]
+                if change * direction > threshold:
+                    regressions.append(f"{label}: {metric} {old[metric]} -> {current[metric]} ({change:+.1%})")
+
+    base_results, new_results = by_position(base), by_position(new)
+    shared = sorted(base_results.keys() & new_results.keys())
+    regressions, changes = [], []
+    for key in shared:
+        old, current = base_results[key], new_results[key]
+        label = "{} d{} {}".format(*key)
+        regressed(label, old, current, POSITION_METRICS)
+        if old["move"] != current["move"]:
+            changes.append(f"{label}: move {old['move']} -> {current['move']}")
+
+    # totals over the shared positions only
+    base_totals = summary({"results": [base_results[key] for key in shared]})
+    new_totals = summary({"results": [new_results[key] for key in shared]})
+    for label in base_totals:
+        regressed(label, base_totals[label], new_totals[label], TOTAL_METRICS)
+
+    return regressions, changes
+
+
+def parse_options(pairs: list) -> dict:
+    # NAME=VALUE pairs, values are json so true, 2 and 0.5 keep their type
+    options = {}
+    for pair in pairs:
+        name, value = pair.split("=", 1)
+        try:
+            options[name] = json.loads(value)
+        except ValueError:
+            options[name] = value
+    return options
+
+
+def summary(run: dict) -> dict:
+    # totals per player and depth
+    totals = {}
+    for r in run["results"]:
+        total = totals.setdefault(f"{r['player']} d{r['depth']}", {"nodes": 0, "time": 0.0})
+        total["nodes"] += r["nodes"]
+        total["time"] += r["time"]
+    for total in totals.values():
+        total["nps"] = round(total["nodes"] / total["time"]) if total["time"] else 0
+        total["time"] = round(total["time"], 3)
+
+    return totals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Engine benchmark over a fixed set of positions")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="search every position and write the results to a json file")
+    run_parser.add_argument("--out", default="benchmark.json")
+    run_parser.add_argument("--players", nargs="+", default=PLAYERS, choices=PLAYERS)
+    run_parser.add_argument("--depths", nargs="+", type=int, default=[2, 3])
+    run_parser.add_argument("--phases", nargs="+", default=list(POSITIONS), choices=list(POSITIONS))
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--repeat", type=int, default=3, help="searches per position, the fastest is kept")
+    run_parser.add_argument("--option", action="append", default=[], metavar="NAME=VALUE",
+                            help="search option of every player, e.g. --option pvs=true --option lmr=true")
+
+    evals_parser = commands.add_parser("evals", help="evaluations per second of the static evaluators")
+    evals_parser.add_argument("--evaluators", nargs="+", default=EVALUATORS, choices=EVALUATORS)
+    evals_parser.add_argument("--rounds", type=int, default=2000, help="passes over the positions")
+
+    compare_parser = commands.add_parser("compare", help="flag regressions of a run against a base run")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="relative change that is flagged")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        positions = {phase: POSITIONS[phase] for phase in args.phases}
+        result = run(args.players, args.depths, positions, args.seed, args.repeat, options=parse_options(args.option))
+        with open(args.out, "w") as file:
+            json.dump(result, file, indent=1)
+        for name, total in summary(result).items():
+            print(f"{name:<41} nodes {total['nodes']:>9} nps {total['nps']:>7} time {total['time']:>8.3f}s")
+    elif args.command == "evals":
+        eval_speed(args.evaluators, rounds=args.rounds)
+    else:
+        with open(args.base) as base_file, open(args.new) as new_file:
+            base, new = json.load(base_file), json.load(new_file)
+        regressions, changes = compare(base, new, args.threshold)
+        for line in regressions + changes:
+            print(line)
+        print(f"{len(regressions)} regressions, {len(changes)} changed moves over {len(new['results'])} searches")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,68 @@
+import os
+import random
+import chess
+import chess.polyglot
+
+from chess import Board, Move
+from typing import List, Optional, Tuple
+
+try:
+    from config import PACKAGE_DIR
+except ModuleNotFoundError:
+    from .config import PACKAGE_DIR
+
+# played from the starting position when there is no book, or the book has no entry for it
+FALLBACK_OPENINGS = ("e2e4", "d2d4", "c2c4", "g1f3")
+
+# books opened so far in this process, shared by every player
+_books = {}
+
+
+class OpeningBook:
+    """Polyglot opening book.
+
+    The file is memory mapped and the entries of a position are found by
+    binary search on its Zobrist key, so opening a book does not read it.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.reader = chess.polyglot.open_reader(path)
+
+    def moves(self, board: Board) -> List[Tuple[Move, int]]:
+        return [(entry.move, entry.weight) for entry in self.reader.find_all(board)]
+
+    def choose(self, board: Board, rng: random.Random=None) -> Optional[Move]:
+        # a book move picked with probability proportional to its weight, from the global random by default
+        try:
+            return self.reader.weighted_choice(board, random=rng).move
+        except IndexError:
+            return None
+
+    def close(self):
+        self.reader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_book(path: str) -> Optional[OpeningBook]:
+    # None when there is no book at path
+    if not path:
+        return None
+    path = os.path.join(PACKAGE_DIR, path)
+    if path not in _books:
+        _books[path] = OpeningBook(path) if os.path.exists(path) else None
+
+    return _books[path]
+
+
+def book_move(board: Board, book: Optional[OpeningBook]) -> Optional[Move]:
+    move = book.choose(board) if book is not None else None
+    if move is None and board.move_stack == [] and board.board_fen() == chess.STARTING_BOARD_FEN and board.turn:
+        move = Move.from_uci(random.choice(FALLBACK_OPENINGS))
+
+    return move
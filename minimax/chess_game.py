@@ -1,38 +1,159 @@
 import chess
-import torch
+import json
+import os
+import numpy as np
 
 from random import random, shuffle
 from game import Game
 from chess import Board
-from typing import List
-from mlp import FlexibleMLP
+from typing import Callable, Iterable, List
+from eval_cache import EvalCache, shared_cache
 
 try:
-    from config import BOARD_SCORES, END_SCORES, LAYERS_SIZE, LAYERS_SIZE_2
+    from config import BOARD_SCORES, END_SCORES, LAYERS_SIZE, LAYERS_SIZE_2, MODEL, MODEL_2, PACKAGE_DIR
 except ModuleNotFoundError:
-    from .config import BOARD_SCORES, END_SCORES, LAYERS_SIZE, LAYERS_SIZE_2
+    from .config import BOARD_SCORES, END_SCORES, LAYERS_SIZE, LAYERS_SIZE_2, MODEL, MODEL_2, PACKAGE_DIR
 
 NAME_TO_SQUARE = dict(zip(chess.SQUARE_NAMES, chess.SQUARES))
 
+def material_weights(board_scores_policy: dict) -> tuple:
+    # piece values in chess.PIECE_TYPES order, pawn to king
+    return tuple(board_scores_policy.get(chess.PIECE_NAMES[piece].upper(), 0) for piece in chess.PIECE_TYPES)
+
+MATERIAL_WEIGHTS = material_weights(BOARD_SCORES)
+
+# terminal status of a position, CHECKMATE means the side to move has lost
+ONGOING = "ONGOING"
+CHECKMATE = "CHECKMATE"
+TIE = "TIE"
+
+# feature order of game_score_with_h: material, center control, mobility, position
+H_FEATURES = 4
+CENTER_SQUARES = [chess.D4, chess.D5, chess.E4, chess.E5]
+
+def piece_square_tables(color: bool) -> tuple:
+    # positional bonus of a piece of color by square, one table per piece type from pawn to king
+    tables = tuple([0.0] * 64 for _ in chess.PIECE_TYPES)
+    for square in chess.SQUARES:
+        rank = chess.square_rank(square)
+        # pawns closer to promotion
+        tables[chess.PAWN - 1][square] = (rank - 1 if color == chess.WHITE else 6 - rank) * 0.1
+        # knights and bishops in the center
+        if square in CENTER_SQUARES:
+            tables[chess.KNIGHT - 1][square] = tables[chess.BISHOP - 1][square] = 0.3
+    return tables
+
+def square_masks(tables: tuple) -> tuple:
+    # (piece index, squares, bonus) per distinct non-zero bonus, so a table is summed with a popcount per mask
+    masks = []
+    for piece, table in enumerate(tables):
+        for bonus in sorted(set(table) - {0.0}):
+            squares = sum(chess.BB_SQUARES[square] for square in chess.SQUARES if table[square] == bonus)
+            masks.append((piece, squares, bonus))
+    return tuple(masks)
+
+POSITION_MASKS = {color: square_masks(piece_square_tables(color)) for color in chess.COLORS}
+
+# per center square, the lookups attackers_mask does for it
+CENTER_ATTACKS = tuple((chess.BB_KING_ATTACKS[square], chess.BB_KNIGHT_ATTACKS[square],
+                        chess.BB_RANK_MASKS[square], chess.BB_RANK_ATTACKS[square],
+                        chess.BB_FILE_MASKS[square], chess.BB_FILE_ATTACKS[square],
+                        chess.BB_DIAG_MASKS[square], chess.BB_DIAG_ATTACKS[square],
+                        chess.BB_PAWN_ATTACKS[chess.BLACK][square], chess.BB_PAWN_ATTACKS[chess.WHITE][square])
+                       for square in CENTER_SQUARES)
+
+# a fivefold repetition needs at least four reversible round trips of two moves each
+FIVEFOLD_MIN_HALFMOVES = 16
+
+def position_key(board: Board):
+    # the exact key python-chess compares positions by when it looks for repetitions
+    return board._transposition_key()
+
+# what a cached evaluation of a child holds, part of its cache key. Only the noise-free part of
+# an ongoing position is cached: terminal scores depend on the path and noise is drawn on every read.
+# Plain material scores are not cached, a few popcounts cost less than the lookup
+H = 1
+
+# what cached values are computed with, bump EVAL_VERSION when an evaluator changes so backing
+# files of the evaluation cache written before are emptied
+EVAL_VERSION = 2
+EVAL_FINGERPRINT = json.dumps([EVAL_VERSION, BOARD_SCORES], sort_keys=True)
+
+def eval_key(board: Board, player: bool, kind: int) -> int:
+    # hash(None) differs between processes before Python 3.12, the en passant square can be None
+    key = position_key(board)
+    return hash(key[:-1] + (-1 if key[-1] is None else key[-1], player, kind))
+
+# models loaded so far in this process, shared by every ChessGame
+_models = {}
+
+def load_model(path: str, layer_sizes: list):
+    # torch is only imported by the first player that needs a model
+    path = os.path.join(PACKAGE_DIR, path)
+    if path not in _models:
+        import torch
+        from mlp import FlexibleMLP
+
+        model = FlexibleMLP(layer_sizes)
+        model.load_state_dict(torch.load(path))
+        model.eval()
+        _models[path] = model
+
+    return _models[path]
+
 class ChessGame(Game):
-    def __init__(self):
+    def __init__(self, cache: EvalCache=None):
         super().__init__()
-        self.model = FlexibleMLP(LAYERS_SIZE)
-        self.second_model = FlexibleMLP(LAYERS_SIZE_2)
-        self.model.load_state_dict(torch.load("model.pth"))
-        self.second_model.load_state_dict(torch.load("model_2.pth"))
-    
+        # evaluations of the positions ordered by the sorted_moves* methods, kept across games
+        self.cache = cache if cache is not None else shared_cache(fingerprint=EVAL_FINGERPRINT)
+
+    @property
+    def model(self):
+        return load_model(MODEL, LAYERS_SIZE)
+
+    @property
+    def second_model(self):
+        return load_model(MODEL_2, LAYERS_SIZE_2)
+
     def predict_h(self, h0):
-        return self.model(torch.tensor([[float(h0)]]))[0][0].item()
+        return self.predict_h_batch([h0])[0]
     
     def predict_h_list(self, h: list):
-        return self.second_model(torch.tensor([[float(i) for i in h]]))[0][0].item()
+        return self.predict_h_list_batch([h])[0]
+
+    # one forward pass for a whole batch of positions, without autograd bookkeeping
+    def predict_h_batch(self, h0s: list) -> List[float]:
+        import torch
+        with torch.inference_mode():
+            return self.model(torch.tensor(h0s, dtype=torch.float32).unsqueeze(1)).squeeze(1).tolist()
+
+    def predict_h_list_batch(self, hs) -> List[float]:
+        import torch
+        with torch.inference_mode():
+            return self.second_model(torch.as_tensor(hs, dtype=torch.float32)).squeeze(1).tolist()
     
     def game_over(self, board: Board, claim_draw: bool=False):
-        if board.is_game_over(claim_draw=claim_draw):
-            return True
+        if claim_draw:
+            return board.is_game_over(claim_draw=True)
 
-        return False
+        return self.terminal_status(board) != ONGOING
+
+    def terminal_status(self, board: Board, repetitions: int=None) -> str:
+        # repetitions is how often the position occurred so far, the search keeps it in a
+        # hash history, without it the move stack is replayed when a repetition is possible
+        if not any(board.generate_legal_moves()):
+            return CHECKMATE if board.is_check() else TIE
+
+        if board.is_insufficient_material() or board.halfmove_clock >= 150:
+            return TIE
+
+        if board.halfmove_clock >= FIVEFOLD_MIN_HALFMOVES:
+            if repetitions is None:
+                repetitions = 5 if board.is_fivefold_repetition() else 1
+            if repetitions >= 5:
+                return TIE
+
+        return ONGOING
     
     def check_win(self, board: Board, player: bool) -> bool:
         if board.is_checkmate() and board.turn == (not player):
@@ -54,174 +175,230 @@ class ChessGame(Game):
 
         return False
     
-    def game_score(self, board, player, end_scores_policy=END_SCORES, board_scores_policy=BOARD_SCORES) -> float:
+    def game_score(self, board, player, end_scores_policy=END_SCORES, board_scores_policy=BOARD_SCORES,
+                   status: str=None) -> float:
         score = None
+        if status is None:
+            status = self.terminal_status(board)
 
-        if self.check_tie(board):
+        if status == TIE:
             score = end_scores_policy["TIE"]
-        elif self.check_win(board, player):
-            score = end_scores_policy["WIN"]
-        elif self.check_win(board, not player):
-            score = end_scores_policy["LOSE"]
+        elif status == CHECKMATE:
+            score = end_scores_policy["WIN"] if board.turn != player else end_scores_policy["LOSE"]
         else:
             score = self.eval_board_state(board, player, board_scores_policy)
 
         return score
     
-    def game_score_with_h(self, board, player, end_scores_policy=END_SCORES, board_scores_policy=BOARD_SCORES) -> float:
+    def game_score_with_h(self, board, player, end_scores_policy=END_SCORES, board_scores_policy=BOARD_SCORES,
+                          status: str=None) -> float:
         score = None
+        if status is None:
+            status = self.terminal_status(board)
 
-        if self.check_tie(board):
+        if status == TIE:
             score = [end_scores_policy["TIE"]] * 4
-        elif self.check_win(board, player):
-            score = [end_scores_policy["WIN"]] * 4
-        elif self.check_win(board, not player):
-            score = [end_scores_policy["LOSE"]] * 4
+        elif status == CHECKMATE:
+            score = [end_scores_policy["WIN"] if board.turn != player else end_scores_policy["LOSE"]] * 4
         else:
-            score = [self.eval_board_state(board, player, board_scores_policy), 
-                     self.eval_board_state_material_control(board, player, board_scores_policy=BOARD_SCORES),
-                     self.eval_board_state_mobility(board, player, board_scores_policy=BOARD_SCORES),
-                     self.eval_board_state_position(board, player, board_scores_policy=BOARD_SCORES)]
+            score = self.h_features(board, player, board_scores_policy)
 
         return score
+
+    def game_score_with_h_matrix(self, boards: Iterable[Board], player: bool, end_scores_policy=END_SCORES,
+                                 board_scores_policy=BOARD_SCORES, status: Callable[[Board], str]=None) -> np.ndarray:
+        # one float32 row of game_score_with_h per board, each board is read before the next one is taken,
+        # with the default policies the rows of ongoing positions come from the cache. status gives the
+        # terminal status of a board, by default it is computed from the board alone
+        cached = end_scores_policy is END_SCORES and board_scores_policy is BOARD_SCORES
+        rows = []
+        for board in boards:
+            board_status = status(board) if status else None
+            if cached:
+                rows.append(self._cached_h(board, player, board_status))
+            else:
+                rows.append(self.game_score_with_h(board, player, end_scores_policy, board_scores_policy, board_status))
+        return np.array(rows, dtype=np.float32).reshape(-1, H_FEATURES)
+
+    def h_features(self, board: Board, player: bool, board_scores_policy: dict=BOARD_SCORES) -> list:
+        # the four eval_board_state* scores in one pass, sharing the material count and its noise
+        noise = random()
+        return [noise + term for term in self.h_terms(board, player, board_scores_policy)]
+
+    def h_terms(self, board: Board, player: bool, board_scores_policy: dict=BOARD_SCORES) -> list:
+        # h_features without the noise
+        material = self.material(board, player, board_scores_policy)
+        # the side to move's legal moves count for it and against its opponent
+        mobility = board.legal_moves.count() * (0.1 if board.turn == player else -0.1)
+
+        return [material, material + self.center_control(board, player), material + mobility,
+                material + self.position(board, player)]
     
     def eval_board_state(self, board, player: bool, board_scores_policy: dict) -> float:
-        total_score = random() 
+        total_score = random() + self.material(board, player, board_scores_policy)
 
-        for piece, score in board_scores_policy.items():
-            piece = getattr(chess, piece)
+        return total_score
 
-            true_score = len(board.pieces(piece, player)) * score
-            false_score = len(board.pieces(piece, not player)) * score * -1
+    def material(self, board: Board, player: bool, board_scores_policy: dict=BOARD_SCORES) -> float:
+        # one popcount per piece bitboard instead of building SquareSets per piece type
+        weights = MATERIAL_WEIGHTS if board_scores_policy is BOARD_SCORES else material_weights(board_scores_policy)
+        ours, theirs = board.occupied_co[player], board.occupied_co[not player]
+        pieces = (board.pawns, board.knights, board.bishops, board.rooks, board.queens, board.kings)
 
-            total_score += (true_score + false_score)
+        score = 0
+        for weight, mask in zip(weights, pieces):
+            if weight:
+                score += weight * (chess.popcount(mask & ours) - chess.popcount(mask & theirs))
 
-        return total_score
+        return score
+
+    def center_control(self, board: Board, player: bool) -> float:
+        # 0.5 per center square player attacks, minus 0.5 per square the opponent attacks, pinned pieces included
+        occupied, pawns = board.occupied, board.pawns
+        ours, theirs = board.occupied_co[player], board.occupied_co[not player]
+        queens_and_rooks, queens_and_bishops = board.queens | board.rooks, board.queens | board.bishops
+
+        control = 0.0
+        # pieces attack a square for both colors alike, so one attacker set is split by color
+        for king, knight, rank, rank_attacks, file, file_attacks, diag, diag_attacks, white_pawns, black_pawns \
+                in CENTER_ATTACKS:
+            attackers = ((king & board.kings) | (knight & board.knights) |
+                         ((rank_attacks[rank & occupied] | file_attacks[file & occupied]) & queens_and_rooks) |
+                         (diag_attacks[diag & occupied] & queens_and_bishops))
+            if player == chess.WHITE:
+                ours_attack, theirs_attack = attackers | (white_pawns & pawns), attackers | (black_pawns & pawns)
+            else:
+                ours_attack, theirs_attack = attackers | (black_pawns & pawns), attackers | (white_pawns & pawns)
+            if ours_attack & ours:
+                control += 0.5
+            if theirs_attack & theirs:
+                control -= 0.5
+
+        return control
+
+    def position(self, board: Board, player: bool) -> float:
+        # piece-square bonus of player's pieces, a popcount per square mask of POSITION_MASKS
+        ours = board.occupied_co[player]
+        pieces = (board.pawns, board.knights, board.bishops, board.rooks, board.queens, board.kings)
+
+        score = 0.0
+        for piece, squares, bonus in POSITION_MASKS[player]:
+            score += bonus * chess.popcount(pieces[piece] & ours & squares)
+
+        return score
 
-    def sorted_moves(self, board: Board, player: bool, limit: int=-1) -> List[str]:
+    def sorted_moves(self, board: Board, player: bool, limit: int=-1,
+                     status: Callable[[Board], str]=None) -> List[str]:
         moves = list(board.legal_moves)
-        scores = []
-        for move in moves:
-            copy_board = board.copy()
-            copy_board.push(move)
-            scores.append(self.game_score(copy_board, player))
+        scores = [self.game_score(child, player, status=status(child) if status else None)
+                  for child in self._children(board, moves)]
 
         moves = sorted(zip(moves, scores), key=lambda x: x[1], reverse=True)
         return moves if limit == -1 else moves[:limit]
     
     # SORT WITH MODEL PREDICTION with one H value
-    def sorted_moves_prediction(self, board: Board, player: bool, limit: int=-1) -> List[str]:
+    def sorted_moves_prediction(self, board: Board, player: bool, limit: int=-1,
+                                status: Callable[[Board], str]=None) -> List[str]:
         moves = list(board.legal_moves)
-        scores = []
+        if not moves:
+            return []
+
+        pieces = []
         for move in moves:
-            copy_board = board.copy()
-            copy_board.push(move)
-            piece = board.piece_type_at(NAME_TO_SQUARE[self.square_name(move)])
+            piece = board.piece_type_at(move.to_square)
             if piece == None:
                 piece = 0.5
-            scores.append(piece * self.predict_h(self.game_score(copy_board, player)))
+            pieces.append(piece)
+        scores = [self.game_score(child, player, status=status(child) if status else None)
+                  for child in self._children(board, moves)]
+        predictions = self.predict_h_batch(scores)
+        scores = [piece * h for piece, h in zip(pieces, predictions)]
 
         moves = sorted(zip(moves, scores), key=lambda x: x[1], reverse=True)
         return moves if limit == -1 else moves[:limit]
     
-    def sorted_moves_with_h_function(self, board: Board, player: bool, limit: int=-1) -> List[str]:
+    def sorted_moves_with_h_function(self, board: Board, player: bool, limit: int=-1,
+                                     status: Callable[[Board], str]=None) -> List[str]:
         moves = list(board.legal_moves)
-        scores = []
-        for move in moves:
-            copy_board = board.copy()
-            copy_board.push(move)
-            scores.append(self.game_score_with_h(copy_board, player))
+        scores = [self._cached_h(child, player, status(child) if status else None)
+                  for child in self._children(board, moves)]
 
         moves = sorted(zip(moves, scores), key=lambda x: sum(x[1]), reverse=True)
         return moves if limit == -1 else moves[:limit]
     
-    def sorted_moves_with_h_function_prediction(self, board: Board, player: bool, limit: int=-1) -> List[str]:
+    def sorted_moves_with_h_function_prediction(self, board: Board, player: bool, limit: int=-1,
+                                                status: Callable[[Board], str]=None) -> List[str]:
         moves = list(board.legal_moves)
-        scores = []
-        for move in moves:
-            copy_board = board.copy()
-            copy_board.push(move)
-            scores.append(self.predict_h_list(self.game_score_with_h(copy_board, player)))
+        if not moves:
+            return []
+
+        rows = self.game_score_with_h_matrix(self._children(board, moves), player, status=status)
+        scores = self.predict_h_list_batch(rows)
 
         moves = sorted(zip(moves, scores), key=lambda x: x[1], reverse=True)
         return moves if limit == -1 else moves[:limit]
-    
-    def eval_board_state_material_control(self, board, player: bool, board_scores_policy: dict) -> float:
-        total_score = random()
 
-        # Material evaluation
-        for piece, score in board_scores_policy.items():
-            piece = getattr(chess, piece)
+    def _cached_h(self, board: Board, player: bool, status: str=None) -> list:
+        # game_score_with_h, with the h terms of an ongoing position taken from the cache
+        if status is None:
+            status = self.terminal_status(board)
+        if status != ONGOING or self.cache is None:
+            return self.game_score_with_h(board, player, status=status)
 
-            true_score = len(board.pieces(piece, player)) * score
-            false_score = len(board.pieces(piece, not player)) * score * -1
+        noise = random()
+        return [noise + term for term in self._cached(board, player, H, self.h_terms)]
 
-            total_score += (true_score + false_score)
+    def _cached(self, board: Board, player: bool, kind: int, evaluate: Callable):
+        key = eval_key(board, player, kind)
+        value = self.cache.get(key)
+        if value is None:
+            value = evaluate(board, player)
+            self.cache.put(key, value)
+
+        return value
+    
+    def eval_board_state_material_control(self, board, player: bool, board_scores_policy: dict) -> float:
+        # Material evaluation
+        total_score = random() + self.material(board, player, board_scores_policy)
 
         # Center control evaluation
-        center_squares = [chess.D4, chess.D5, chess.E4, chess.E5]
-        for square in center_squares:
-            if board.is_attacked_by(player, square):
-                total_score += 0.5  # Bonus for controlling the center
-            if board.is_attacked_by(not player, square):
-                total_score -= 0.5  # Penalty for opponent controlling the center
+        total_score += self.center_control(board, player)
 
         return total_score
     
     def eval_board_state_position(self, board, player: bool, board_scores_policy: dict) -> float:
-        total_score = random()
-
         # Material evaluation
-        for piece, score in board_scores_policy.items():
-            piece = getattr(chess, piece)
-
-            true_score = len(board.pieces(piece, player)) * score
-            false_score = len(board.pieces(piece, not player)) * score * -1
-
-            total_score += (true_score + false_score)
-
-        # Positional evaluation
-        for square in chess.SQUARES:
-            piece = board.piece_at(square)
-            if piece and piece.color == player:
-                if piece.piece_type == chess.PAWN:
-                    # Bonus for pawns closer to promotion
-                    rank = chess.square_rank(square)
-                    if player == chess.WHITE:
-                        total_score += (rank - 1) * 0.1  # Closer to rank 7 for White
-                    else:
-                        total_score += (6 - rank) * 0.1  # Closer to rank 2 for Black
-                elif piece.piece_type in {chess.KNIGHT, chess.BISHOP}:
-                    # Bonus for central position
-                    if square in [chess.D4, chess.D5, chess.E4, chess.E5]:
-                        total_score += 0.3
+        total_score = random() + self.material(board, player, board_scores_policy)
+
+        # Positional evaluation, pawns closer to promotion and knights and bishops in the center
+        total_score += self.position(board, player)
 
         return total_score
     
     def eval_board_state_mobility(self, board, player: bool, board_scores_policy: dict) -> float:
-        total_score = random()
-
         # Material evaluation
-        for piece, score in board_scores_policy.items():
-            piece = getattr(chess, piece)
-
-            true_score = len(board.pieces(piece, player)) * score
-            false_score = len(board.pieces(piece, not player)) * score * -1
-
-            total_score += (true_score + false_score)
+        total_score = random() + self.material(board, player, board_scores_policy)
 
         # Mobility evaluation
         if board.turn == player:
             legal_moves = len(list(board.legal_moves))
             total_score += legal_moves * 0.1  # Bonus for mobility
         else:
-            board.turn = not player
-            opponent_legal_moves = len(list(board.legal_moves))
+            # the opponent is to move, the board is left untouched so it can be searched in place
+            opponent_legal_moves = board.legal_moves.count()
             total_score -= opponent_legal_moves * 0.1
-            board.turn = player  # Restore the turn
 
         return total_score
 
+    def _children(self, board: Board, moves: list):
+        # yields the board after each move, the move is taken back when the next one is requested
+        for move in moves:
+            board.push(move)
+            try:
+                yield board
+            finally:
+                board.pop()
+
     def square_name(self, move):
         return move.uci()[2:]
 
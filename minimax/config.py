@@ -1,9 +1,56 @@
+import os
+
+# relative data and model paths are resolved against the package directory
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
 DEFAULT_DEPTH = 3
 DATA = "data.csv"
 LAYERS_SIZE=[1, 64, 32, 16, 1]
 DATA_2 = "data2.csv"
 LAYERS_SIZE_2=[4, 64, 32, 16, 1]
 NUMBER_OF_GAMES=10
+MODEL = "model.pth"
+MODEL_2 = "model_2.pth"
+# evaluations kept in memory by each process, 0 disables the cache, with an optional
+# SQLite file shared by every process
+EVAL_CACHE_SIZE=200000
+EVAL_CACHE_PATH=None
+# polyglot opening book of the minimax players, none is used when the file does not exist
+BOOK = "book.bin"
+# training rows buffered by the data writer before they are written out
+DATA_BLOCK_SIZE=4096
+# rows per batch read from a binary training file, and csv rows parsed at a time when converting
+BATCH_SIZE=4096
+CONVERT_CHUNK_ROWS=1000000
+# training stops after PATIENCE epochs without a better validation L1
+EPOCHS=1000
+PATIENCE=20
+LEARNING_RATE=0.01
+# memory cap of the transposition table of each minimax player, 0 disables it
+TT_SIZE_MB=64
+# deepest iteration of a time-budgeted search
+MAX_DEPTH=32
+# order moves with the search's own staged generator (TT move, captures, killers, history)
+# instead of the player's heuristic, except where training rows are recorded
+STAGED_MOVES=False
+# principal variation search: moves after the first are searched with a zero window first
+PVS=False
+# null-move pruning outside check and king and pawn endgames, searched this many plies shallower
+NULL_MOVE=False
+NULL_MOVE_REDUCTION=2
+# late-move reductions: quiet moves after the first LMR_MIN_MOVES are searched one ply
+# shallower at depth LMR_MIN_DEPTH or more, and again at full depth when they raise alpha
+LMR=False
+LMR_MIN_DEPTH=3
+LMR_MIN_MOVES=3
+# half width of the root window of each iteration around the previous score, 0 searches full windows
+ASPIRATION_WINDOW=0
+# captures-only extension at the leaves, optionally with quiet checks on its first ply
+QUIESCENCE=False
+QUIESCENCE_CHECKS=False
+QUIESCENCE_DEPTH=8
+# a capture is skipped when even winning the piece plus this margin cannot raise alpha
+DELTA_MARGIN=2
 
 BOARD_SCORES = {
     "PAWN": 1,
@@ -0,0 +1,135 @@
+import csv
+import os
+import shutil
+import struct
+import threading
+import numpy as np
+
+from queue import Queue
+
+try:
+    from config import DATA_BLOCK_SIZE
+except ModuleNotFoundError:
+    from .config import DATA_BLOCK_SIZE
+
+# binary files: 16 byte header (magic, number of columns, padding) followed by float32 rows
+BINARY_SUFFIX = ".f32"
+BINARY_MAGIC = b"F32R"
+BINARY_HEADER = struct.Struct("<4sI8x")
+
+_FLUSH = object()
+_CLOSE = object()
+
+
+def read_binary_header(file) -> int:
+    magic, columns = BINARY_HEADER.unpack(file.read(BINARY_HEADER.size))
+    assert magic == BINARY_MAGIC, "Not a float32 row file!"
+    return columns
+
+
+def merge_files(parts: list, path: str):
+    # appends the rows of every part file to path and deletes the parts
+    binary = path.endswith(BINARY_SUFFIX)
+    with open(path, "ab") as out:
+        columns = None
+        if binary and out.tell() > 0:
+            with open(path, "rb") as existing:
+                columns = read_binary_header(existing)
+
+        for part in parts:
+            with open(part, "rb") as file:
+                if binary and os.path.getsize(part) > 0:
+                    part_columns = read_binary_header(file)
+                    if columns is None:
+                        columns = part_columns
+                        out.write(BINARY_HEADER.pack(BINARY_MAGIC, columns))
+                    assert part_columns == columns, "Rows of a binary file must have the same width!"
+                shutil.copyfileobj(file, out)
+            os.remove(part)
+
+
+class DataWriter:
+    """Appends training rows to a csv or float32 file from a background thread.
+
+    write() only queues the row, the thread writes them in blocks of
+    block_size rows, on flush() and on close().
+    """
+
+    def __init__(self, path: str, block_size: int=DATA_BLOCK_SIZE, binary: bool=False):
+        self.path = path
+        self.block_size = block_size
+        self.binary = binary
+        self.rows_written = 0
+        self.error = None
+
+        self.file = open(path, mode="ab" if binary else "a", newline=None if binary else "")
+        self.columns = None
+        if binary and self.file.tell() > 0:
+            with open(path, "rb") as existing:
+                self.columns = read_binary_header(existing)
+
+        self.queue = Queue()
+        self.thread = threading.Thread(target=self._run, name=f"DataWriter({path})", daemon=True)
+        self.thread.start()
+
+    def write(self, row: list, key: int=None, depth: int=0):
+        # key and depth are only kept by a PositionStore, they are accepted so either can be written to
+        self.queue.put(row)
+
+    def flush(self):
+        # blocks until every queued row is on disk
+        self.queue.put(_FLUSH)
+        self.queue.join()
+        self._raise_error()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(_CLOSE)
+            self.thread.join()
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _run(self):
+        with self.file as file:
+            block = []
+            while True:
+                row = self.queue.get()
+                try:
+                    if row is not _FLUSH and row is not _CLOSE:
+                        block.append(row)
+                    if block and (len(block) >= self.block_size or row is _FLUSH or row is _CLOSE):
+                        self._write_block(file, block)
+                except Exception as error:
+                    # reported to the caller on the next flush or close
+                    self.error = error
+                finally:
+                    if len(block) >= self.block_size or row is _FLUSH or row is _CLOSE:
+                        block = []
+                    self.queue.task_done()
+
+                if row is _CLOSE:
+                    break
+
+    def _write_block(self, file, block: list):
+        if self.binary:
+            block = np.asarray(block, dtype="<f4")
+            if self.columns is None:
+                self.columns = block.shape[1]
+                file.write(BINARY_HEADER.pack(BINARY_MAGIC, self.columns))
+            assert block.ndim == 2 and block.shape[1] == self.columns, "Rows of a binary file must have the same width!"
+            file.write(block.tobytes())
+        else:
+            csv.writer(file).writerows(block)
+
+        file.flush()
+        self.rows_written += len(block)
@@ -0,0 +1,100 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+import torch
+
+from time import time
+from torch.utils.data import Dataset, DataLoader, Subset
+from data_writer import BINARY_SUFFIX, BINARY_MAGIC, BINARY_HEADER, read_binary_header
+
+try:
+    from config import BATCH_SIZE, CONVERT_CHUNK_ROWS
+except ModuleNotFoundError:
+    from .config import BATCH_SIZE, CONVERT_CHUNK_ROWS
+
+
+def binary_path(csv_path: str) -> str:
+    return os.path.splitext(csv_path)[0] + BINARY_SUFFIX
+
+
+def csv_to_binary(csv_path: str, path: str=None, chunk_rows: int=CONVERT_CHUNK_ROWS) -> int:
+    # streams a headerless csv of training rows into a float32 row file, returns the number of rows
+    path = path or binary_path(csv_path)
+    rows = 0
+    with open(path, "wb") as file:
+        for chunk in pd.read_csv(csv_path, header=None, dtype=np.float32, chunksize=chunk_rows):
+            if rows == 0:
+                file.write(BINARY_HEADER.pack(BINARY_MAGIC, chunk.shape[1]))
+            file.write(chunk.to_numpy(dtype="<f4").tobytes())
+            rows += len(chunk)
+
+    return rows
+
+
+def open_rows(path: str) -> np.memmap:
+    # read-only (rows, columns) view of a float32 row file
+    with open(path, "rb") as file:
+        columns = read_binary_header(file)
+    rows = (os.path.getsize(path) - BINARY_HEADER.size) // (4 * columns)
+
+    return np.memmap(path, dtype="<f4", mode="r", offset=BINARY_HEADER.size, shape=(rows, columns))
+
+
+class RowBatchDataset(Dataset):
+    """Batches of contiguous rows of a float32 row file.
+
+    Item i is rows [i * batch_size, (i + 1) * batch_size) split into
+    features and target, so a DataLoader should use batch_size=None.
+    The file is memory mapped on first access in each process.
+    """
+
+    def __init__(self, path: str, batch_size: int=BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self._rows = None
+        with open(path, "rb") as file:
+            self.columns = read_binary_header(file)
+        self.rows = (os.path.getsize(path) - BINARY_HEADER.size) // (4 * self.columns)
+
+    def __len__(self) -> int:
+        return -(-self.rows // self.batch_size)
+
+    def __getitem__(self, i: int):
+        if self._rows is None:
+            self._rows = open_rows(self.path)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+
+        batch = torch.from_numpy(np.array(self._rows[i * self.batch_size:(i + 1) * self.batch_size]))
+        return batch[:, :-1], batch[:, -1]
+
+    def __getstate__(self) -> dict:
+        # DataLoader workers map the file themselves instead of receiving a copy of it
+        return dict(self.__dict__, _rows=None)
+
+
+def split_batches(dataset: RowBatchDataset, test_fraction: float=0.2, seed: int=0):
+    # random split of whole batches, rows of one batch stay on the same side, each side gets at least one batch
+    assert len(dataset) >= 2, (f"{dataset.path} has {dataset.rows} rows, a single batch of {dataset.batch_size}: "
+                               "use a smaller batch size to keep a validation batch!")
+    order = torch.randperm(len(dataset), generator=torch.Generator().manual_seed(seed)).tolist()
+    test_size = min(max(1, int(test_fraction * len(dataset))), len(dataset) - 1)
+
+    return Subset(dataset, order[test_size:]), Subset(dataset, order[:test_size])
+
+
+def batch_loader(dataset: Dataset, shuffle: bool=False, workers: int=0) -> DataLoader:
+    return DataLoader(dataset, batch_size=None, shuffle=shuffle, num_workers=workers,
+                      persistent_workers=workers > 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert csv training rows to memory-mapped float32 files")
+    parser.add_argument("csv", nargs="+")
+    args = parser.parse_args()
+
+    for csv_path in args.csv:
+        start_time = time()
+        rows = csv_to_binary(csv_path)
+        print(f"{csv_path} -> {binary_path(csv_path)}: {rows} rows in {time() - start_time:.2f}s")
@@ -61,6 +61,10 @@ class GameVisualize:
                     clear_output(wait=True)
         except KeyboardInterrupt:
             print("Game stopped!")
+        finally:
+            # write out and close the players' training data files
+            white_p.end_game()
+            black_p.end_game()
             
         if self.game.check_tie(board, claim_draw=False):
             result = -1
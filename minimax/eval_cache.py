@@ -0,0 +1,149 @@
+import atexit
+import json
+import os
+import sqlite3
+import threading
+
+from collections import OrderedDict
+from typing import Optional
+
+try:
+    from config import EVAL_CACHE_SIZE, EVAL_CACHE_PATH, DATA_BLOCK_SIZE, PACKAGE_DIR
+except ModuleNotFoundError:
+    from .config import EVAL_CACHE_SIZE, EVAL_CACHE_PATH, DATA_BLOCK_SIZE, PACKAGE_DIR
+
+_SCHEMA = "CREATE TABLE IF NOT EXISTS evaluations (key INTEGER PRIMARY KEY, value TEXT NOT NULL)"
+_META_SCHEMA = "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)"
+
+# caches opened so far in this process, by backing file
+_caches = {}
+
+
+class EvalCache:
+    """LRU cache of evaluations, optionally backed by a SQLite file.
+
+    Keys are Python hashes of position keys, which are the same in every
+    process, so worker processes can share the backing file. Memory misses
+    are looked up on disk, and new values are written to it in blocks of
+    block_size. fingerprint names what the values were computed with, a
+    backing file written with another fingerprint is emptied when opened.
+    """
+
+    def __init__(self, size: int=EVAL_CACHE_SIZE, path: str=None, block_size: int=DATA_BLOCK_SIZE,
+                 fingerprint: str=""):
+        self.size = size
+        self.path = path
+        self.block_size = block_size
+        self.entries = OrderedDict()
+        self.pending = []
+        # a pondering player evaluates from its own thread while the other player searches
+        self.lock = threading.RLock()
+        self.connection = None
+        if path:
+            self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(_SCHEMA)
+            self._check_fingerprint(fingerprint)
+        self.clear_stats()
+
+    def _check_fingerprint(self, fingerprint: str):
+        with self.connection:
+            self.connection.execute(_META_SCHEMA)
+            row = self.connection.execute("SELECT value FROM meta WHERE name = 'fingerprint'").fetchone()
+            if row is None or row[0] != fingerprint:
+                self.connection.execute("DELETE FROM evaluations")
+                self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('fingerprint', ?)", (fingerprint,))
+
+    def clear_stats(self):
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def clear(self):
+        # forgets the entries in memory, the backing file is kept
+        with self.lock:
+            self.entries.clear()
+            self.clear_stats()
+
+    def get(self, key: int) -> Optional[object]:
+        with self.lock:
+            entries = self.entries
+            value = entries.get(key)
+            if value is not None:
+                entries.move_to_end(key)
+                self.hits += 1
+                return value
+
+            if self.connection is not None:
+                row = self.connection.execute("SELECT value FROM evaluations WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self.disk_hits += 1
+                    value = json.loads(row[0])
+                    self._remember(key, value)
+                    return value
+
+            self.misses += 1
+            return None
+
+    def put(self, key: int, value):
+        with self.lock:
+            self._remember(key, value)
+            if self.connection is not None:
+                self.pending.append((key, json.dumps(value)))
+                if len(self.pending) >= self.block_size:
+                    self.flush()
+
+    def _remember(self, key: int, value):
+        entries = self.entries
+        entries[key] = value
+        if len(entries) > self.size:
+            entries.popitem(last=False)
+
+    def flush(self):
+        with self.lock:
+            if self.pending:
+                with self.connection:
+                    self.connection.executemany("INSERT OR IGNORE INTO evaluations VALUES (?, ?)", self.pending)
+                self.pending = []
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.flush()
+                self.connection.close()
+                self.connection = None
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.disk_hits + self.misses
+        return (self.hits + self.disk_hits) / lookups if lookups else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "filled": len(self.entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hit_rate(), 4),
+        }
+
+
+def shared_cache(size: int=EVAL_CACHE_SIZE, path: str=EVAL_CACHE_PATH, fingerprint: str="") -> Optional[EvalCache]:
+    # one cache per backing file in a process, None when caching is off
+    if not size:
+        return None
+    if path:
+        path = os.path.join(PACKAGE_DIR, path)
+    if path not in _caches:
+        _caches[path] = EvalCache(size, path, fingerprint=fingerprint)
+
+    return _caches[path]
+
+
+@atexit.register
+def close_caches():
+    # writes out the pending values of every backing file, pool workers exit without running atexit
+    # so they flush from Player.end_game
+    for cache in _caches.values():
+        if cache is not None:
+            cache.close()
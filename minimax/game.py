@@ -8,6 +8,10 @@ class Game():
     def game_over(self, claim_draw: bool=False):
         pass
 
+    @abstractmethod
+    def terminal_status(self, board, repetitions: int=None):
+        pass
+
     @abstractmethod
     def game_score(self):
         pass
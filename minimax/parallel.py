@@ -0,0 +1,150 @@
+import argparse
+import multiprocessing as mp
+import os
+
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from time import time
+from math import inf
+from chess import Board, Move
+from player import Player, MiniMaxPlayer
+from search import SearchTimeout
+from book import book_move
+
+try:
+    from config import DEFAULT_DEPTH, MAX_DEPTH, END_SCORES
+except ModuleNotFoundError:
+    from .config import DEFAULT_DEPTH, MAX_DEPTH, END_SCORES
+
+# state of a pool worker, built once by _init_worker
+_worker = {}
+
+
+def limit_torch_threads():
+    # run in every pool worker, the pool already uses every core, keep torch from oversubscribing them
+    import torch
+    torch.set_num_threads(1)
+
+
+def _init_worker(player_class: type, player_kwargs: dict, shared_alpha):
+    limit_torch_threads()
+    _worker["bot"] = player_class(True, **player_kwargs)
+    _worker["alpha"] = shared_alpha
+
+
+def _search_root_move(board: Board, move: Move, depth: int, deadline: float=None):
+    # searches one root move with the best root score found so far as lower bound, and returns that bound:
+    # a score that does not beat it is only an upper bound of the move's score
+    engine = _worker["bot"].engine
+    shared_alpha = _worker["alpha"]
+
+    bound = shared_alpha.value
+    board.push(move)
+    engine.deadline = deadline
+    try:
+        score = -engine.search(board, depth - 1, alpha=-inf, beta=-bound)[0]
+    except SearchTimeout:
+        return move, None, bound, engine.stats.nodes
+    finally:
+        engine.deadline = None
+
+    with shared_alpha.get_lock():
+        if score > shared_alpha.value:
+            shared_alpha.value = score
+
+    return move, score, bound, engine.stats.nodes
+
+
+class RootParallelPlayer(Player):
+    """Splits the root moves of a minimax player over a process pool.
+
+    Each worker builds its own player, and with it its own ChessGame and
+    transposition table, once. The best root score found so far is shared
+    between workers and used as the lower bound of every later root move.
+    """
+
+    def __init__(self, player, player_class: type=MiniMaxPlayer, workers: int=os.cpu_count(),
+                 depth=DEFAULT_DEPTH, **player_kwargs):
+        self.bot = player_class(player, depth=depth, **player_kwargs)
+        super().__init__(player, self.bot.game, f"root parallel {self.bot.solver}, workers = {workers}")
+        self.depth = depth
+        self.workers = workers
+        # nodes searched by the workers for the last move
+        self.nodes = 0
+
+        context = mp.get_context("spawn")
+        self.shared_alpha = context.Value("d", -inf)
+        self.pool = ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker,
+                                        initargs=(player_class, dict(player_kwargs, depth=depth), self.shared_alpha))
+
+    def _search(self, board: Board, depth: int, deadline: float=None) -> list:
+        moves = [move for move, _ in self.bot.order_moves(board)]
+        self.shared_alpha.value = -inf
+
+        # the eldest move is searched alone so the others start with a real bound
+        best_move, best_score, _, nodes = self.pool.submit(_search_root_move, board, moves[0], depth, deadline).result()
+        self.nodes += nodes
+        if best_score is None:
+            return None
+
+        pending = {self.pool.submit(_search_root_move, board, move, depth, deadline) for move in moves[1:]}
+        complete = True
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                move, score, bound, nodes = future.result()
+                self.nodes += nodes
+                if score is None:
+                    complete = False
+                elif score > bound and score > best_score:
+                    best_move, best_score = move, score
+
+        return [best_score, best_move] if complete else None
+
+    def search(self, board: Board, depth: int, time_budget: float=None) -> list:
+        self.nodes = 0
+        if time_budget is None:
+            return self._search(board, depth)
+
+        start_time = time()
+        best_move = self._search(board, 1)
+        for depth in range(2, MAX_DEPTH + 1):
+            if best_move[0] >= END_SCORES["WIN"]:
+                break
+            result = self._search(board, depth, start_time + time_budget)
+            if result is None:
+                break
+            best_move = result
+
+        return best_move
+
+    def move(self, board: Board, time_budget: float=None) -> str:
+        move = book_move(board, self.bot.book)
+        if move is not None:
+            return move.uci()
+
+        return self.search(board, self.depth, time_budget)[1].uci()
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+
+if __name__ == "__main__":
+    # scaling report: time to depth and nodes/sec for a range of pool sizes
+    parser = argparse.ArgumentParser(description="Root-parallel minimax scaling report")
+    parser.add_argument("--fen", default="r2q1rk1/ppp2ppp/2np1n2/2b1p1B1/2B1P1b1/2NP1N2/PPP2PPP/R2Q1RK1 w - - 0 8")
+    parser.add_argument("--depth", type=int, default=DEFAULT_DEPTH)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    board = Board(args.fen)
+    print(f"{'workers':>8} {'depth':>6} {'time (s)':>9} {'nodes':>9} {'nodes/s':>9}  move")
+    for workers in args.workers:
+        bot = RootParallelPlayer(board.turn, workers=workers, depth=args.depth)
+        # warm up: every worker loads its models before the clock starts
+        bot.search(board, 1)
+
+        start_time = time()
+        score, move = bot.search(board, args.depth)
+        elapsed = time() - start_time
+        print(f"{workers:>8} {args.depth:>6} {elapsed:>9.2f} {bot.nodes:>9} {bot.nodes / elapsed:>9.0f}  {move.uci()}")
+        bot.close()
@@ -1,58 +1,62 @@
-import logging as log
-import csv
 import os
+import threading
 
 from time import time
 from abc import ABC, abstractmethod
-from math import inf
 from random import choice
-from chess_game import ChessGame
+from math import inf
+from chess_game import ChessGame, position_key
 from game import Game
 from chess import Board, Move
+from search import NegamaxSearch
+from transposition import board_key
+from stats import SearchStats
+from data_writer import DataWriter, BINARY_SUFFIX
+from position_store import PositionStore, STORE_SUFFIX
+from book import open_book, book_move
+from typing import Callable, Tuple
 
 try:
-    from config import BOARD_SCORES, END_SCORES, DEFAULT_DEPTH, DATA, DATA_2
+    from config import BOARD_SCORES, END_SCORES, DEFAULT_DEPTH, DATA, DATA_2, TT_SIZE_MB, PACKAGE_DIR, BOOK
 except ModuleNotFoundError:
-    from .config import BOARD_SCORES, END_SCORES, DEFAULT_DEPTH, DATA, DATA_2
-
-
-# Change the working directory to the directory containing this script
-os.chdir(os.path.dirname(os.path.abspath(__file__)))
-file = open(DATA, mode='a', newline='')
-writer = csv.writer(file)
+    from .config import BOARD_SCORES, END_SCORES, DEFAULT_DEPTH, DATA, DATA_2, TT_SIZE_MB, PACKAGE_DIR, BOOK
 
-file_2 = open(DATA_2, mode='a', newline='')
-writer_2 = csv.writer(file_2)
 
-def write_to_csv(input_value: float, output_value: float):
+def write_to_csv(writer: DataWriter, input_value: float, output_value: float, key: int=None, depth: int=0):
     if input_value == 100 and output_value == 100:
         return
-    # Write the data row
-    writer.writerow([input_value, output_value])
-    print(f"Added row: {input_value}, {output_value}")
+    # Queue the data row, the writer thread writes it out in blocks
+    writer.write([input_value, output_value], key, depth)
 
-def write_to_csv_list(row: list):
+def write_to_csv_list(writer: DataWriter, row: list, key: int=None, depth: int=0):
     if row == [0] * len(row) or row == [100] * len(row):
         return
-    # Write the data row
-    writer_2.writerow(row)
-    print(f"Added row: {row}")
+    # Queue the data row, the writer thread writes it out in blocks
+    writer.write(row, key, depth)
 
 class Player(ABC):
-    def __init__(self, player: bool, game: Game=ChessGame(), solver: str=None):
+    def __init__(self, player: bool, game: Game=None, solver: str=None):
         self.player = player
         self.solver = solver
-        self.game = game
+        # ChessGame is cheap to build, its models are loaded once per process on first use
+        self.game = game or ChessGame()
 
     @abstractmethod
-    def move(self):
+    def move(self, board: Board, time_budget: float=None):
+        pass
+
+    def ponder(self, board: Board):
+        # called with the board right after this player's move
+        pass
+
+    def end_game(self):
         pass
 
 class RandomPlayer(Player):
-    def __init__(self, player: bool, game: Game=ChessGame()):
+    def __init__(self, player: bool, game: Game=None):
         super().__init__(player, game, "random")
 
-    def move(self, board: Board) -> str:
+    def move(self, board: Board, time_budget: float=None) -> str:
         assert board.turn == self.player, "Not bot turn to move!"
         
         moves = list(board.legal_moves)
@@ -60,303 +64,170 @@ class RandomPlayer(Player):
 
         return move
 
-class MiniMaxPlayer(Player):
-    def __init__(self, player, game: Game=ChessGame(), depth=DEFAULT_DEPTH, 
-                 choice_limit=-1, verbose=False, generate_data=False):
-        super().__init__(player, game, f"minimax, depth = {depth}, limit = {choice_limit}")
-        self.depth = depth
-        self.verbose = verbose
-        # limit number of choices
-        self.limit = choice_limit
-        self.generate_data = generate_data
-
-    def _minimax(self, board: Board, player: bool, depth: int, alpha: float=-inf, beta: float=inf):
-        # base case
-        if depth == 0 or self.game.game_over(board):
-            return [self.game.game_score(board, self.player, END_SCORES, BOARD_SCORES), None]
-
-        # first move for white
-        if len(board.move_stack) == 0:
-            white_opening = choice(("e2e4", "d2d4", "c2c4", "g1f3"))
-            return white_opening
-
-        moves = self.game.sorted_moves(board, player, self.limit)
-
-        if board.turn == player:
-            maxScore, bestMove = -inf, None
-
-            for move, h_value in moves:
-                test_board = board.copy()
-                test_board.push(move)
-
-                score = self._minimax(test_board, not player, depth - 1, alpha, beta)
-                # print('score', score, 'H' + str(DEFAULT_DEPTH - depth), h_value, depth)
-                if self.generate_data and depth == DEFAULT_DEPTH:
-                    write_to_csv(h_value, score[0])
-                
-                if self.verbose:
-                    log.info(f"{self.game.turn_side(test_board)}, M{len(moves)}, D{depth}:{move} - SCORE: {score}")
-
-                alpha = max(alpha, score[0])
-                if beta <= alpha:
-                    break
-
-                if score[0] >= maxScore:
-                    maxScore = score[0]
-                    bestMove = move
-
-            return [maxScore, bestMove]
-        else:
-            minScore, bestMove = inf, None
-
-            for move, h_value in moves:
-                test_board = board.copy()
-                test_board.push(move)
-
-                score = self._minimax(test_board, player, depth - 1, alpha, beta)
-                # print('score', score, 'H' + str(DEFAULT_DEPTH - depth), h_value, depth)
-                if self.generate_data and depth == DEFAULT_DEPTH:
-                    write_to_csv(h_value, score[0])
-
-                if self.verbose:
-                    log.info(f"{self.game.turn_side(test_board)}, M{len(moves)}, D{depth}:{move} - SCORE: {score}")
-                
-                beta = min(beta, score[0])
-                if beta <= alpha:
-                    break
-
-                if score[0] <= minScore:
-                    minScore = score[0]
-                    bestMove = move
-
-            return [minScore, bestMove]
-
-    def move(self, board: Board) -> str:
-        best_move = self._minimax(board, self.player, self.depth)
-        if type(best_move) == str:
-            return best_move
-        return best_move[1].uci()
-    
-class MiniMaxPlayerWithRegressor(Player):
-    def __init__(self, player, game: Game=ChessGame(), depth=DEFAULT_DEPTH, choice_limit=-1, verbose=False):
-        super().__init__(player, game, f"minimax with regressor, depth = {depth}, limit = {choice_limit}")
-        self.depth = depth
-        self.verbose = verbose
-        # limit number of choices
-        self.limit = choice_limit
-
-    def _minimax(self, board: Board, player: bool, depth: int, alpha: float=-inf, beta: float=inf):
-        # base case
-        if depth == 0 or self.game.game_over(board):
-            return [self.game.game_score(board, self.player, END_SCORES, BOARD_SCORES), None]
-
-        # first move for white
-        if len(board.move_stack) == 0:
-            white_opening = choice(("e2e4", "d2d4", "c2c4", "g1f3"))
-            return white_opening
-
-        moves = self.game.sorted_moves_prediction(board, player, self.limit)
-        print(moves)
-        return moves[0][::-1]
+class SearchPlayer(Player):
+    """Base of the minimax players, they only differ in how moves are ordered."""
 
-        if board.turn == player:
-            maxScore, bestMove = -inf, None
+    # file the generated training rows go to, a .f32 file is written in binary and
+    # a .sqlite file is a PositionStore that keeps one row per position
+    data_path = None
 
-            for move, h_value in moves:
-                test_board = board.copy()
-                test_board.push(move)
-
-                score = self._minimax(test_board, not player, depth - 1, alpha, beta)
-                
-                if self.verbose:
-                    log.info(f"{self.game.turn_side(test_board)}, M{len(moves)}, D{depth}:{move} - SCORE: {score}")
-
-                alpha = max(alpha, score[0])
-                if beta <= alpha:
-                    break
-
-                if score[0] >= maxScore:
-                    maxScore = score[0]
-                    bestMove = move
-
-            return [maxScore, bestMove]
-        else:
-            minScore, bestMove = inf, None
-
-            for move, h_value in moves:
-                test_board = board.copy()
-                test_board.push(move)
-
-                score = self._minimax(test_board, player, depth - 1, alpha, beta)
-
-                if self.verbose:
-                    log.info(f"{self.game.turn_side(test_board)}, M{len(moves)}, D{depth}:{move} - SCORE: {score}")
-                
-                beta = min(beta, score[0])
-                if beta <= alpha:
-                    break
-
-                if score[0] <= minScore:
-                    minScore = score[0]
-                    bestMove = move
-
-            return [minScore, bestMove]
-
-    def move(self, board: Board) -> str:
-        best_move = self._minimax(board, self.player, self.depth)
-        print(best_move)
-        if type(best_move) == str:
-            return best_move
-        return best_move[1].uci()
-    
-class MiniMaxPlayerWithHFunction(Player):
-    def __init__(self, player, game: Game=ChessGame(), depth=DEFAULT_DEPTH, choice_limit=-1, verbose=False, generate_data=False):
-        super().__init__(player, game, f"minimax with new H function, depth = {depth}, limit = {choice_limit}")
+    def __init__(self, player, game: Game, solver: str, depth=DEFAULT_DEPTH, choice_limit=-1,
+                 verbose=False, generate_data=False, tt_size=TT_SIZE_MB, data_path: str=None, book: str=BOOK,
+                 ponder: bool=False, **search_options):
+        super().__init__(player, game, solver)
         self.depth = depth
         self.verbose = verbose
         # limit number of choices
         self.limit = choice_limit
         self.generate_data = generate_data
+        self.data_path = data_path or self.data_path
+        if self.data_path is not None:
+            self.data_path = os.path.join(PACKAGE_DIR, self.data_path)
+        # opened on the first recorded row, closed at the end of every game
+        self.writer = None
+        self.book = open_book(book)
+        self.engine = NegamaxSearch(self.order_moves, self.evaluate, self.game.terminal_status, tt_size, verbose,
+                                    record=self.record if generate_data else None, record_depth=DEFAULT_DEPTH,
+                                    **search_options)
+        self.tt = self.engine.tt
+        # search the expected reply on the opponent's time, training rows only come from played moves
+        self.pondering = ponder and not generate_data and self.tt is not None
+        self.ponder_thread = None
+        self.ponder_board = None
+        self.ponder_result = None
+        self.ponder_hits = 0
+        self.ponder_misses = 0
 
-    def _minimax(self, board: Board, player: bool, depth: int, alpha: float=-inf, beta: float=inf):
-        # base case
-        if depth == 0 or self.game.game_over(board):
-            return [self.game.game_score(board, self.player, END_SCORES, BOARD_SCORES), None]
-
-        # first move for white
-        if len(board.move_stack) == 0:
-            white_opening = choice(("e2e4", "d2d4", "c2c4", "g1f3"))
-            return white_opening
-
-        moves = self.game.sorted_moves_with_h_function(board, player, self.limit)
-
-        if board.turn == player:
-            maxScore, bestMove = -inf, None
-
-            for move, h_value in moves:
-                test_board = board.copy()
-                test_board.push(move)
-
-                score = self._minimax(test_board, not player, depth - 1, alpha, beta)
-                # print('score', score, 'H' + str(DEFAULT_DEPTH - depth), h_value, depth)
-                if self.generate_data and depth == DEFAULT_DEPTH:
-                    write_to_csv_list(h_value + [score[0]])
-                
-                if self.verbose:
-                    log.info(f"{self.game.turn_side(test_board)}, M{len(moves)}, D{depth}:{move} - SCORE: {score}")
+    @abstractmethod
+    def order_moves(self, board: Board, status: Callable[[Board], str]=None) -> list:
+        pass
 
-                alpha = max(alpha, score[0])
-                if beta <= alpha:
-                    break
+    def evaluate(self, board: Board, status: str=None) -> float:
+        return self.game.game_score(board, board.turn, END_SCORES, BOARD_SCORES, status)
 
-                if score[0] >= maxScore:
-                    maxScore = score[0]
-                    bestMove = move
+    def record(self, h_value, score: float, key: int, depth: int):
+        pass
 
-            return [maxScore, bestMove]
+    def data_writer(self) -> DataWriter:
+        if self.writer is None:
+            if self.data_path.endswith(STORE_SUFFIX):
+                self.writer = PositionStore(self.data_path)
+            else:
+                self.writer = DataWriter(self.data_path, binary=self.data_path.endswith(BINARY_SUFFIX))
+        return self.writer
+
+    def end_game(self):
+        self.stop_pondering()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        # the cache is shared by every player of the process, its pending values are only written out
+        if self.game.cache is not None:
+            self.game.cache.flush()
+
+    def ponder(self, board: Board):
+        if not self.pondering or self.ponder_thread is not None:
+            return
+
+        # the reply our search expects is the best move stored for the position after our move
+        entry = self.tt.get(board_key(board))
+        if entry is None or entry[4] is None or not board.is_legal(entry[4]):
+            return
+
+        self.ponder_board = board.copy()
+        self.ponder_board.push(entry[4])
+        self.ponder_result = None
+        self.ponder_thread = threading.Thread(target=self._ponder, args=(self.ponder_board.copy(),),
+                                              name=f"ponder({self.solver})", daemon=True)
+        self.ponder_thread.start()
+
+    def _ponder(self, board: Board):
+        # iterative deepening up to the player's depth, until it completes or is stopped
+        self.ponder_result = self.engine.search(board, self.depth, inf, max_depth=self.depth)
+
+    def stop_pondering(self):
+        if self.ponder_thread is not None:
+            self.engine.stopped = True
+            self.ponder_thread.join()
+            self.engine.stopped = False
+            self.ponder_thread = None
+
+    def _ponder_hit(self, board: Board, time_budget: float=None) -> bool:
+        if self.ponder_thread is None:
+            return False
+
+        hit = (len(board.move_stack) == len(self.ponder_board.move_stack)
+               and position_key(board) == position_key(self.ponder_board))
+        if hit:
+            # the reply was predicted, the search of this position goes on for at most the move's time budget
+            # and then returns its last complete iteration
+            self.ponder_thread.join(time_budget)
+            self.stop_pondering()
+            self.ponder_hits += 1
         else:
-            minScore, bestMove = inf, None
-
-            for move, h_value in moves:
-                test_board = board.copy()
-                test_board.push(move)
-
-                score = self._minimax(test_board, player, depth - 1, alpha, beta)
-                # print('score', score, 'H' + str(DEFAULT_DEPTH - depth), h_value, depth)
-                if self.generate_data and depth == DEFAULT_DEPTH:
-                    write_to_csv_list(h_value + [score[0]])
-
-                if self.verbose:
-                    log.info(f"{self.game.turn_side(test_board)}, M{len(moves)}, D{depth}:{move} - SCORE: {score}")
-                
-                beta = min(beta, score[0])
-                if beta <= alpha:
-                    break
-
-                if score[0] <= minScore:
-                    minScore = score[0]
-                    bestMove = move
-
-            return [minScore, bestMove]
-
-    def move(self, board: Board) -> str:
-        best_move = self._minimax(board, self.player, self.depth)
-        if type(best_move) == str:
-            return best_move
-        return best_move[1].uci()
-    
-class MiniMaxPlayerWithHFunctionPrediction(Player):
-    def __init__(self, player, game: Game=ChessGame(), depth=DEFAULT_DEPTH, choice_limit=-1, verbose=False, generate_data=False):
-        super().__init__(player, game, f"minimax with new H function prediction, depth = {depth}, limit = {choice_limit}")
-        self.depth = depth
-        self.verbose = verbose
-        # limit number of choices
-        self.limit = choice_limit
-        self.generate_data = generate_data
+            self.stop_pondering()
+            self.ponder_misses += 1
 
-    def _minimax(self, board: Board, player: bool, depth: int, alpha: float=-inf, beta: float=inf):
-        # base case
-        if depth == 0 or self.game.game_over(board):
-            return [self.game.game_score(board, self.player, END_SCORES, BOARD_SCORES), None]
+        return hit and self.ponder_result is not None and self.ponder_result[1] is not None
 
-        # first move for white
-        if len(board.move_stack) == 0:
-            white_opening = choice(("e2e4", "d2d4", "c2c4", "g1f3"))
-            return white_opening
+    def move_with_stats(self, board: Board, time_budget: float=None) -> Tuple[str, SearchStats]:
+        # known positions are played from the book without searching
+        move = book_move(board, self.book)
+        if move is not None:
+            self.stop_pondering()
+            return move.uci(), SearchStats()
 
-        moves = self.game.sorted_moves_with_h_function_prediction(board, player, self.limit)
-        return moves[0][::-1]
+        if self._ponder_hit(board, time_budget):
+            return self.ponder_result[1].uci(), self.engine.stats
 
-        if board.turn == player:
-            maxScore, bestMove = -inf, None
+        best_move = self.engine.search(board, self.depth, time_budget)
+        return best_move[1].uci(), self.engine.stats
 
-            for move, h_value in moves:
-                test_board = board.copy()
-                test_board.push(move)
+    def move(self, board: Board, time_budget: float=None) -> str:
+        return self.move_with_stats(board, time_budget)[0]
 
-                score = self._minimax(test_board, not player, depth - 1, alpha, beta)
-                # print('score', score, 'H' + str(DEFAULT_DEPTH - depth), h_value, depth)
-                
-                if self.verbose:
-                    log.info(f"{self.game.turn_side(test_board)}, M{len(moves)}, D{depth}:{move} - SCORE: {score}")
+class MiniMaxPlayer(SearchPlayer):
+    data_path = DATA
 
-                alpha = max(alpha, score[0])
-                if beta <= alpha:
-                    break
+    def __init__(self, player, game: Game=None, depth=DEFAULT_DEPTH, 
+                 choice_limit=-1, verbose=False, generate_data=False, tt_size=TT_SIZE_MB, **search_options):
+        super().__init__(player, game, f"minimax, depth = {depth}, limit = {choice_limit}",
+                         depth, choice_limit, verbose, generate_data, tt_size, **search_options)
 
-                if score[0] >= maxScore:
-                    maxScore = score[0]
-                    bestMove = move
-
-            return [maxScore, bestMove]
-        else:
-            minScore, bestMove = inf, None
+    def order_moves(self, board: Board, status: Callable[[Board], str]=None) -> list:
+        return self.game.sorted_moves(board, board.turn, self.limit, status)
 
-            for move, h_value in moves:
-                test_board = board.copy()
-                test_board.push(move)
+    def record(self, h_value: float, score: float, key: int, depth: int):
+        write_to_csv(self.data_writer(), h_value, score, key, depth)
+    
+class MiniMaxPlayerWithRegressor(SearchPlayer):
+    def __init__(self, player, game: Game=None, depth=DEFAULT_DEPTH, choice_limit=-1, verbose=False, tt_size=TT_SIZE_MB, **search_options):
+        super().__init__(player, game, f"minimax with regressor, depth = {depth}, limit = {choice_limit}",
+                         depth, choice_limit, verbose, False, tt_size, **search_options)
 
-                score = self._minimax(test_board, player, depth - 1, alpha, beta)
-                # print('score', score, 'H' + str(DEFAULT_DEPTH - depth), h_value, depth)
+    def order_moves(self, board: Board, status: Callable[[Board], str]=None) -> list:
+        return self.game.sorted_moves_prediction(board, board.turn, self.limit, status)
+    
+class MiniMaxPlayerWithHFunction(SearchPlayer):
+    data_path = DATA_2
 
-                if self.verbose:
-                    log.info(f"{self.game.turn_side(test_board)}, M{len(moves)}, D{depth}:{move} - SCORE: {score}")
-                
-                beta = min(beta, score[0])
-                if beta <= alpha:
-                    break
+    def __init__(self, player, game: Game=None, depth=DEFAULT_DEPTH, choice_limit=-1, verbose=False, generate_data=False, tt_size=TT_SIZE_MB, **search_options):
+        super().__init__(player, game, f"minimax with new H function, depth = {depth}, limit = {choice_limit}",
+                         depth, choice_limit, verbose, generate_data, tt_size, **search_options)
 
-                if score[0] <= minScore:
-                    minScore = score[0]
-                    bestMove = move
+    def order_moves(self, board: Board, status: Callable[[Board], str]=None) -> list:
+        return self.game.sorted_moves_with_h_function(board, board.turn, self.limit, status)
 
-            return [minScore, bestMove]
+    def record(self, h_value: list, score: float, key: int, depth: int):
+        write_to_csv_list(self.data_writer(), h_value + [score], key, depth)
+    
+class MiniMaxPlayerWithHFunctionPrediction(SearchPlayer):
+    def __init__(self, player, game: Game=None, depth=DEFAULT_DEPTH, choice_limit=-1, verbose=False, tt_size=TT_SIZE_MB, **search_options):
+        super().__init__(player, game, f"minimax with new H function prediction, depth = {depth}, limit = {choice_limit}",
+                         depth, choice_limit, verbose, False, tt_size, **search_options)
 
-    def move(self, board: Board) -> str:
-        best_move = self._minimax(board, self.player, self.depth)
-        if type(best_move) == str:
-            return best_move
-        return best_move[1].uci()
+    def order_moves(self, board: Board, status: Callable[[Board], str]=None) -> list:
+        return self.game.sorted_moves_with_h_function_prediction(board, board.turn, self.limit, status)
     
 if __name__ == "__main__":
     test_board = Board()
@@ -364,6 +235,6 @@ if __name__ == "__main__":
     test_bot = MiniMaxPlayerWithRegressor(player=True, game=chess_game, verbose=False)
 
     start_time = time()
-    print(test_bot._minimax(test_board, True, 5))
+    print(test_bot.engine.search(test_board, 5))
     # print(test_bot.move(test_board))
-    print(time() - start_time)
\ No newline at end of file
+    print(time() - start_time)
@@ -0,0 +1,141 @@
+import argparse
+import os
+import sqlite3
+import numpy as np
+
+from data_writer import DataWriter, BINARY_SUFFIX
+
+try:
+    from config import DATA_BLOCK_SIZE
+except ModuleNotFoundError:
+    from .config import DATA_BLOCK_SIZE
+
+STORE_SUFFIX = ".sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS positions (
+    key INTEGER PRIMARY KEY,
+    features BLOB NOT NULL,
+    score_sum REAL NOT NULL,
+    count INTEGER NOT NULL,
+    depth INTEGER NOT NULL,
+    depth_score REAL NOT NULL
+)
+"""
+
+# in the update, bare column names are the stored row and excluded is the incoming one
+_UPSERT = """
+INSERT INTO positions (key, features, score_sum, count, depth, depth_score) {source}
+ON CONFLICT (key) DO UPDATE SET
+    score_sum = score_sum + excluded.score_sum,
+    count = count + excluded.count,
+    depth_score = CASE WHEN excluded.depth > depth THEN excluded.depth_score ELSE depth_score END,
+    depth = MAX(depth, excluded.depth)
+"""
+
+
+def _signed(key: int) -> int:
+    # sqlite integers are signed 64 bit, Zobrist keys are unsigned
+    return key - 2 ** 64 if key >= 2 ** 63 else key
+
+
+class PositionStore:
+    """Training samples deduplicated by the Zobrist key of their position.
+
+    A position keeps the features of its first sample, the sum and number
+    of its scores, and the score of its deepest search. write() buffers
+    samples and upserts them in blocks of block_size.
+    """
+
+    def __init__(self, path: str, block_size: int=DATA_BLOCK_SIZE):
+        self.path = path
+        self.block_size = block_size
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(_SCHEMA)
+        self.pending = []
+
+    def write(self, row: list, key: int=None, depth: int=0):
+        # row is the features followed by the score, like a DataWriter row
+        assert key is not None, "Samples of a position store need the position key!"
+        features = np.asarray(row[:-1], dtype="<f4").tobytes()
+        self.pending.append((_signed(key), features, float(row[-1]), 1, depth, float(row[-1])))
+        if len(self.pending) >= self.block_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            with self.connection:
+                self.connection.executemany(_UPSERT.format(source="VALUES (?, ?, ?, ?, ?, ?)"), self.pending)
+            self.pending = []
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self) -> int:
+        self.flush()
+        return self.connection.execute("SELECT COUNT(*) FROM positions").fetchone()[0]
+
+    def samples(self) -> int:
+        # samples written, duplicates included
+        self.flush()
+        return self.connection.execute("SELECT COALESCE(SUM(count), 0) FROM positions").fetchone()[0]
+
+    def merge(self, path: str):
+        # adds the positions of another store to this one
+        self.flush()
+        self.connection.execute("ATTACH DATABASE ? AS other", (path,))
+        try:
+            with self.connection:
+                # WHERE true keeps the ON CONFLICT clause from being parsed as a join constraint
+                self.connection.execute(_UPSERT.format(source="SELECT * FROM other.positions WHERE true"))
+        finally:
+            self.connection.execute("DETACH DATABASE other")
+
+    def export(self, path: str, target: str="mean", min_count: int=1) -> int:
+        """Writes one row per position, its features followed by the mean or the deepest score.
+
+        The file is replaced, a .f32 path is written in binary. Returns the number of rows.
+        """
+        assert target in ("mean", "deepest"), "target is either mean or deepest!"
+        self.flush()
+        if os.path.exists(path):
+            os.remove(path)
+
+        column = "score_sum / count" if target == "mean" else "depth_score"
+        rows = self.connection.execute(f"SELECT features, {column} FROM positions WHERE count >= ? ORDER BY key",
+                                       (min_count,))
+        with DataWriter(path, binary=path.endswith(BINARY_SUFFIX)) as writer:
+            for features, score in rows:
+                writer.write(np.frombuffer(features, dtype="<f4").tolist() + [score])
+
+        return writer.rows_written
+
+
+def merge_stores(parts: list, path: str):
+    # merges every part store into path and deletes the parts
+    with PositionStore(path) as store:
+        for part in parts:
+            store.merge(part)
+    for part in parts:
+        os.remove(part)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a deduplicated position store as training rows")
+    parser.add_argument("store")
+    parser.add_argument("out", help="csv or .f32 file, replaced if it exists")
+    parser.add_argument("--target", choices=["mean", "deepest"], default="mean")
+    parser.add_argument("--min-count", type=int, default=1)
+    args = parser.parse_args()
+
+    with PositionStore(args.store) as store:
+        positions, samples = len(store), store.samples()
+        rows = store.export(args.out, args.target, args.min_count)
+    print(f"{samples} samples, {positions} positions, {rows} rows written to {args.out}")
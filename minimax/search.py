@@ -0,0 +1,423 @@
+import logging as log
+import chess
+
+from collections import Counter
+from time import time
+from math import inf
+from chess import Board, Move
+from typing import Callable, Iterator, List, Tuple
+from transposition import TranspositionTable, board_key, probe_window, bound_flag, principal_variation
+from stats import SearchStats
+from chess_game import ONGOING, position_key
+
+try:
+    from config import (BOARD_SCORES, END_SCORES, TT_SIZE_MB, MAX_DEPTH, QUIESCENCE, QUIESCENCE_CHECKS,
+                        QUIESCENCE_DEPTH, DELTA_MARGIN, STAGED_MOVES, PVS, NULL_MOVE, NULL_MOVE_REDUCTION, LMR,
+                        LMR_MIN_DEPTH, LMR_MIN_MOVES, ASPIRATION_WINDOW)
+except ModuleNotFoundError:
+    from .config import (BOARD_SCORES, END_SCORES, TT_SIZE_MB, MAX_DEPTH, QUIESCENCE, QUIESCENCE_CHECKS,
+                         QUIESCENCE_DEPTH, DELTA_MARGIN, STAGED_MOVES, PVS, NULL_MOVE, NULL_MOVE_REDUCTION, LMR,
+                         LMR_MIN_DEPTH, LMR_MIN_MOVES, ASPIRATION_WINDOW)
+
+# material value by piece type, used for capture ordering and delta pruning
+PIECE_VALUES = [0] + [BOARD_SCORES[chess.piece_name(piece).upper()] for piece in chess.PIECE_TYPES]
+# width of the zero windows of PVS, null-move and reduced searches, scores are not integers
+ZERO_WINDOW = 1e-6
+
+# (board, terminal status of a child) -> [(move, h_value), ...] best first for the side to move
+MoveOrderer = Callable[[Board, Callable[[Board], str]], List[Tuple[Move, object]]]
+# (board, terminal status) -> score for the side to move
+LeafEvaluator = Callable[[Board, str], float]
+# (board, times the position occurred) -> terminal status
+TerminalStatus = Callable[[Board, int], str]
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class NegamaxSearch:
+    """Alpha-beta negamax shared by all minimax players.
+
+    Players plug in how moves are ordered and how leaves are scored,
+    every score inside the search is relative to the side to move.
+    """
+
+    def __init__(self, order_moves: MoveOrderer, evaluate: LeafEvaluator, terminal_status: TerminalStatus,
+                 tt_size: float=TT_SIZE_MB, verbose: bool=False,
+                 record: Callable[[object, float, int, int], None]=None, record_depth: int=None,
+                 quiescence: bool=QUIESCENCE, quiescence_checks: bool=QUIESCENCE_CHECKS, profile: bool=False,
+                 staged: bool=STAGED_MOVES, pvs: bool=PVS, null_move: bool=NULL_MOVE, lmr: bool=LMR,
+                 aspiration_window: float=ASPIRATION_WINDOW):
+        self.order_moves = order_moves
+        self.evaluate = evaluate
+        self.terminal_status = terminal_status
+        self.verbose = verbose
+        # time move ordering, evaluation and move generation, off by default as it wraps every call
+        self.profile = profile
+        self.quiescence = quiescence
+        self.quiescence_checks = quiescence_checks
+        self.staged = staged
+        # two quiet moves per ply that last caused a cutoff, and cutoff counts by (from, to) square
+        self.killers = []
+        self.move_history = [[0] * 64 for _ in range(64)]
+        self.root_ply = 0
+        self.pvs = pvs
+        self.null_move = null_move
+        self.lmr = lmr
+        self.aspiration_window = aspiration_window
+        # transposition table, tt_size is its memory cap in MB
+        self.tt = TranspositionTable(tt_size) if tt_size else None
+        # called with (h_value, score, child's Zobrist key, child's search depth) for the children
+        # of nodes with record_depth plies left
+        self.record = record
+        self.record_depth = record_depth
+        # set while a time-budgeted search is running
+        self.deadline = None
+        # set from another thread to stop a time-budgeted search, it then returns its last complete iteration
+        self.stopped = False
+        # position key -> move of the previous iteration's principal variation
+        self.pv = {}
+        self.root_turn = None
+        # position key -> occurrences on the path from the last irreversible move to the current node
+        self.history = Counter()
+        # position key -> terminal status of the children of the node being ordered
+        self._child_statuses = {}
+        # counters of the last search
+        self.stats = SearchStats()
+        self._order_moves, self._evaluate, self._terminal_status = order_moves, evaluate, terminal_status
+
+    def search(self, board: Board, depth: int, time_budget: float=None,
+               alpha: float=-inf, beta: float=inf, max_depth: int=MAX_DEPTH) -> List:
+        # the search pushes and pops moves on a single private board
+        board = board.copy()
+        self.root_turn = board.turn
+        if self.tt is not None:
+            self.tt.new_search()
+        self.pv = {}
+        self._seed_history(board)
+        self._start_stats()
+        self.root_ply = len(board.move_stack)
+        if self.staged:
+            self.killers = [[None, None] for _ in range(max(depth, max_depth) + 1)]
+            self.move_history = [[0] * 64 for _ in range(64)]
+
+        try:
+            # fixed depth search, stopped only by a deadline set by the caller
+            if time_budget is None:
+                result = self._negamax(board, depth, alpha, beta)
+                self.stats.depths.append((depth, time() - self._start_time, self.stats.nodes))
+            else:
+                result = self._iterative_deepening(board, time_budget, max_depth)
+        finally:
+            self._finish_stats()
+
+        self.stats.score, self.stats.move = result
+        if self.verbose:
+            log.info(self.stats)
+
+        return result
+
+    def _start_stats(self):
+        self.stats = stats = SearchStats()
+        self._start_time = time()
+        if self.tt is not None:
+            self._tt_counters = (self.tt.probes, self.tt.hits)
+
+        if self.profile:
+            self._order_moves = stats.timed(self.order_moves, "ordering")
+            self._evaluate = stats.timed(self.evaluate, "evaluation")
+            self._terminal_status = stats.timed(self.terminal_status, "movegen")
+        else:
+            self._order_moves, self._evaluate, self._terminal_status = (self.order_moves, self.evaluate,
+                                                                        self.terminal_status)
+
+    def _finish_stats(self):
+        stats = self.stats
+        stats.time = time() - self._start_time
+        stats.depth = stats.depths[-1][0] if stats.depths else 0
+        if self.tt is not None:
+            stats.tt_probes = self.tt.probes - self._tt_counters[0]
+            stats.tt_hits = self.tt.hits - self._tt_counters[1]
+
+    def _seed_history(self, board: Board):
+        # only positions since the last capture or pawn move can repeat
+        self.history = Counter()
+        board = board.copy()
+        self.history[position_key(board)] += 1
+        for _ in range(min(board.halfmove_clock, len(board.move_stack))):
+            board.pop()
+            self.history[position_key(board)] += 1
+
+    def _iterative_deepening(self, board: Board, time_budget: float, max_depth: int=MAX_DEPTH) -> List:
+        start_time = time()
+        best_move = None
+        try:
+            for depth in range(1, max_depth + 1):
+                # depth 1 always completes so there is a move to return
+                self.deadline = None if depth == 1 else start_time + time_budget
+                result = self._aspiration(board, depth, best_move[0] if best_move else None)
+                if result[1] is None:
+                    return result
+
+                best_move = result
+                self.stats.depths.append((depth, time() - start_time, self.stats.nodes))
+                if result[0] >= END_SCORES["WIN"]:
+                    break
+
+                # order the next iteration along this one's principal variation
+                if self.tt is not None:
+                    self.pv = dict(principal_variation(self.tt, board, depth))
+                else:
+                    self.pv = {board_key(board): result[1]}
+        except SearchTimeout:
+            pass
+        finally:
+            self.deadline = None
+
+        return best_move
+
+    def _aspiration(self, board: Board, depth: int, previous: float) -> List:
+        # a window around the previous iteration's score, searched again with a full window when the score falls outside
+        window = self.aspiration_window
+        if not window or previous is None or abs(previous) >= END_SCORES["WIN"]:
+            return self._negamax(board, depth, -inf, inf)
+
+        alpha, beta = previous - window, previous + window
+        result = self._negamax(board, depth, alpha, beta)
+        if alpha < result[0] < beta:
+            return result
+        self.stats.researches += 1
+        return self._negamax(board, depth, -inf, inf)
+
+    def _negamax(self, board: Board, depth: int, alpha: float, beta: float, status: str=None) -> List:
+        stats = self.stats
+        stats.nodes += 1
+        if self.deadline is not None and (self.stopped or time() > self.deadline):
+            raise SearchTimeout()
+
+        # base case, the terminal status is computed once, here or by the parent's move ordering,
+        # and shared with the evaluator
+        if status is None:
+            status = self._terminal_status(board, self.history[position_key(board)])
+        if status != ONGOING:
+            stats.evals += 1
+            return [self._evaluate(board, status), None]
+        if depth == 0:
+            if self.quiescence:
+                return [self._quiescence(board, alpha, beta, 0, status), None]
+            stats.evals += 1
+            return [self._evaluate(board, status), None]
+
+        recording = self.record is not None and depth == self.record_depth
+        key, tt_move = None, None
+        if self.tt is not None or self.pv:
+            key = board_key(board)
+            tt_move = self.pv.get(key)
+        if self.tt is not None:
+            entry = self.tt.probe(key)
+            # a recording node searches its children even when the table knows its score, only the move is used
+            if entry is not None and not recording:
+                tt_score, alpha, beta = probe_window(entry, depth, alpha, beta)
+                if tt_score is not None:
+                    return [tt_score, entry[4]]
+            if entry is not None:
+                tt_move = tt_move or entry[4]
+        alpha_orig = alpha
+
+        in_check = board.is_check()
+        if self.null_move and not recording and self._null_move_allowed(board, depth, beta, in_check):
+            # passing is almost always worse than the best move, so if passing still fails high the node does too
+            board.push(Move.null())
+            score = -self._negamax(board, depth - 1 - NULL_MOVE_REDUCTION, -beta, -beta + ZERO_WINDOW)[0]
+            board.pop()
+            if score >= beta:
+                stats.null_cutoffs += 1
+                return [beta, None]
+
+        # the recorded rows need the player's h values, elsewhere moves can come from the staged generator
+        statuses = {}
+        if self.staged and not recording:
+            ply = len(board.move_stack) - self.root_ply
+            moves = self._staged_moves(board, tt_move, ply)
+        else:
+            self._child_statuses = statuses
+            moves = self._order_moves(board, self.child_status)
+            if tt_move is not None:
+                moves.sort(key=lambda x: x[0] != tt_move)
+
+        best_score, best_move = -inf, None
+        for i, (move, h_value) in enumerate(moves):
+            quiet = not move.promotion and not board.is_capture(move)
+            board.push(move)
+            child_key = position_key(board)
+            self.history[child_key] += 1
+            # recorded rows keep the full window score of every child
+            if i == 0 or recording:
+                score = -self._negamax(board, depth - 1, -beta, -alpha, statuses.get(child_key))[0]
+            else:
+                score = self._late_move(board, depth, alpha, beta, i, quiet and not in_check,
+                                        statuses.get(child_key))
+            self.history[child_key] -= 1
+
+            if recording:
+                sample_key = board_key(board)
+            if self.verbose:
+                log.info(f"{'White' if board.turn else 'Black'}, M{i + 1}, D{depth}:{move} - SCORE: {score}")
+            board.pop()
+
+            if recording:
+                # recorded scores are from the point of view of the searching player
+                self.record(h_value, score if board.turn == self.root_turn else -score, sample_key, depth - 1)
+
+            if score > best_score:
+                best_score, best_move = score, move
+
+            alpha = max(alpha, score)
+            if alpha >= beta:
+                stats.cutoffs += 1
+                if i == 0:
+                    stats.first_move_cutoffs += 1
+                if self.staged and not board.is_capture(move):
+                    self._update_quiet_cutoff(move, depth, len(board.move_stack) - self.root_ply)
+                break
+
+        if self.tt is not None:
+            self.tt.store(key, depth, best_score, bound_flag(best_score, alpha_orig, beta), best_move)
+
+        return [best_score, best_move]
+
+    def child_status(self, board: Board) -> str:
+        # terminal status of a child pushed by the move ordering, from the hash history,
+        # kept until the search visits the child
+        key = position_key(board)
+        status = self._child_statuses[key] = self._terminal_status(board, self.history[key] + 1)
+        return status
+
+    def _late_move(self, board: Board, depth: int, alpha: float, beta: float, i: int, quiet: bool,
+                   status: str=None) -> float:
+        # score of a move after the first, the move is pushed on board
+        stats = self.stats
+        if self.lmr and quiet and depth >= LMR_MIN_DEPTH and i >= LMR_MIN_MOVES and not board.is_check():
+            stats.reductions += 1
+            score = -self._negamax(board, depth - 2, -alpha - ZERO_WINDOW, -alpha, status)[0]
+            if score <= alpha:
+                return score
+            stats.researches += 1
+
+        if self.pvs:
+            score = -self._negamax(board, depth - 1, -alpha - ZERO_WINDOW, -alpha, status)[0]
+            # only a score inside the window needs its exact value
+            if not alpha < score < beta:
+                return score
+            stats.researches += 1
+
+        return -self._negamax(board, depth - 1, -beta, -alpha, status)[0]
+
+    def _null_move_allowed(self, board: Board, depth: int, beta: float, in_check: bool) -> bool:
+        # not at the root, in check, after another null move, or with only king and pawns where zugzwang is common
+        if in_check or depth <= NULL_MOVE_REDUCTION or beta >= END_SCORES["WIN"]:
+            return False
+        if len(board.move_stack) == self.root_ply or (board.move_stack and not board.move_stack[-1]):
+            return False
+        return bool(board.occupied_co[board.turn] & ~(board.pawns | board.kings))
+
+    def _quiescence(self, board: Board, alpha: float, beta: float, ply: int, status: str=None) -> float:
+        stats = self.stats
+        stats.nodes += 1
+        stats.qnodes += 1
+        if self.deadline is not None and (self.stopped or time() > self.deadline):
+            raise SearchTimeout()
+
+        # past the first ply every move was a capture or an evasion, so no repetition to track
+        if status is None:
+            status = self._terminal_status(board, 1)
+        if status != ONGOING:
+            stats.evals += 1
+            return self._evaluate(board, status)
+
+        in_check = board.is_check()
+        if in_check:
+            # no standing pat in check, every evasion is searched
+            stand_pat = -inf
+            moves = list(board.legal_moves)
+        else:
+            stats.evals += 1
+            stand_pat = self._evaluate(board, status)
+            if stand_pat >= beta or ply >= QUIESCENCE_DEPTH:
+                return stand_pat
+            alpha = max(alpha, stand_pat)
+            moves = self._captures(board)
+            if self.quiescence_checks and ply == 0:
+                moves += [move for move in board.legal_moves
+                          if not board.is_capture(move) and not move.promotion and board.gives_check(move)]
+
+        best_score = stand_pat
+        for move in moves:
+            # delta pruning: even winning the captured piece cannot raise alpha
+            if not in_check and not move.promotion and board.is_capture(move):
+                if stand_pat + self._victim_value(board, move) + DELTA_MARGIN <= alpha:
+                    continue
+
+            board.push(move)
+            score = -self._quiescence(board, -beta, -alpha, ply + 1)
+            board.pop()
+
+            if score > best_score:
+                best_score = score
+            if score >= beta:
+                stats.qcutoffs += 1
+                break
+            alpha = max(alpha, score)
+
+        if best_score == -inf:
+            # in check with no evasion left to try
+            stats.evals += 1
+            return self._evaluate(board, status)
+
+        return best_score
+
+    def _staged_moves(self, board: Board, tt_move: Move, ply: int) -> Iterator[Tuple[Move, None]]:
+        # each stage is only generated once the previous ones failed to cut off
+        tried = set()
+        if tt_move is not None and board.is_legal(tt_move):
+            tried.add(tt_move)
+            yield tt_move, None
+
+        for move in self._captures(board):
+            if move not in tried:
+                tried.add(move)
+                yield move, None
+
+        killers = self.killers[ply] if ply < len(self.killers) else ()
+        for move in killers:
+            if move is not None and move not in tried and board.is_legal(move) and not board.is_capture(move):
+                tried.add(move)
+                yield move, None
+
+        # promotions first, then by how often the move caused a cutoff so far
+        history = self.move_history
+        quiets = [move for move in board.generate_legal_moves(to_mask=~board.occupied_co[not board.turn])
+                  if move not in tried and not board.is_en_passant(move)]
+        quiets.sort(key=lambda move: (move.promotion or 0, history[move.from_square][move.to_square]), reverse=True)
+        for move in quiets:
+            yield move, None
+
+    def _update_quiet_cutoff(self, move: Move, depth: int, ply: int):
+        if ply < len(self.killers):
+            killers = self.killers[ply]
+            if killers[0] != move:
+                killers[1], killers[0] = killers[0], move
+        self.move_history[move.from_square][move.to_square] += depth * depth
+
+    def _victim_value(self, board: Board, move: Move) -> int:
+        victim = board.piece_type_at(move.to_square)
+        # en passant is the only capture onto an empty square
+        return PIECE_VALUES[victim] if victim else PIECE_VALUES[chess.PAWN]
+
+    def _captures(self, board: Board) -> List[Move]:
+        # most valuable victim first, least valuable attacker breaks ties
+        captures = list(board.generate_legal_captures())
+        captures.sort(key=lambda move: (self._victim_value(board, move),
+                                        -PIECE_VALUES[board.piece_type_at(move.from_square)]), reverse=True)
+        return captures
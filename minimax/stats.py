@@ -0,0 +1,96 @@
+from time import perf_counter
+from typing import Callable
+
+
+class SearchStats:
+    """Counters of one search, returned alongside the chosen move.
+
+    The counters are plain integer increments. Timing of move ordering,
+    evaluation and move generation is only collected by profiling searches.
+    """
+
+    def __init__(self):
+        self.move = None
+        self.score = None
+        self.depth = 0
+        self.time = 0.0
+        self.nodes = 0
+        # quiescence nodes, also counted in nodes
+        self.qnodes = 0
+        self.evals = 0
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+        # quiescence cutoffs, not counted in cutoffs so the first move cutoff rate is the main search's
+        self.qcutoffs = 0
+        self.tt_probes = 0
+        self.tt_hits = 0
+        # null-move cutoffs, reduced searches, and zero-window or reduced searches searched again
+        self.null_cutoffs = 0
+        self.reductions = 0
+        self.researches = 0
+        # (depth, seconds since the search started, nodes so far) per completed iteration
+        self.depths = []
+        self.times = {"ordering": 0.0, "evaluation": 0.0, "movegen": 0.0}
+
+    def timed(self, fn: Callable, section: str) -> Callable:
+        times = self.times
+
+        def wrapper(*args):
+            start = perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                times[section] += perf_counter() - start
+
+        return wrapper
+
+    @property
+    def first_move_cutoff_rate(self) -> float:
+        return self.first_move_cutoffs / self.cutoffs if self.cutoffs else 0.0
+
+    @property
+    def branching_factor(self) -> float:
+        # node growth between the last two iterations, or the depth-th root of the node count
+        if len(self.depths) >= 2:
+            totals = [0] + [nodes for _, _, nodes in self.depths]
+            last, previous = totals[-1] - totals[-2], totals[-2] - totals[-3]
+            return last / previous if previous else 0.0
+        if self.depth > 0 and self.nodes > 1:
+            return self.nodes ** (1 / self.depth)
+        return 0.0
+
+    @property
+    def nps(self) -> float:
+        return self.nodes / self.time if self.time else 0.0
+
+    @property
+    def tt_hit_rate(self) -> float:
+        return self.tt_hits / self.tt_probes if self.tt_probes else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "move": self.move.uci() if self.move else None,
+            "score": self.score,
+            "depth": self.depth,
+            "time": round(self.time, 4),
+            "nodes": self.nodes,
+            "qnodes": self.qnodes,
+            "nps": round(self.nps),
+            "evals": self.evals,
+            "cutoffs": self.cutoffs,
+            "qcutoffs": self.qcutoffs,
+            "first_move_cutoff_rate": round(self.first_move_cutoff_rate, 4),
+            "branching_factor": round(self.branching_factor, 2),
+            "tt_probes": self.tt_probes,
+            "tt_hits": self.tt_hits,
+            "tt_hit_rate": round(self.tt_hit_rate, 4),
+            "null_cutoffs": self.null_cutoffs,
+            "reductions": self.reductions,
+            "researches": self.researches,
+            "depths": [(depth, round(seconds, 4), nodes) for depth, seconds, nodes in self.depths],
+            "times": {section: round(seconds, 4) for section, seconds in self.times.items()},
+        }
+
+    def __repr__(self) -> str:
+        return (f"SearchStats(move={self.move}, depth={self.depth}, nodes={self.nodes}, "
+                f"nps={self.nps:.0f}, cutoffs={self.cutoffs}, tt_hit_rate={self.tt_hit_rate:.2f})")
@@ -0,0 +1,177 @@
+import argparse
+import multiprocessing as mp
+import os
+import random
+import numpy as np
+import pandas as pd
+import player as players
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import count
+from time import time
+from chess import Board
+from chess_game import ChessGame
+from data_writer import merge_files
+from parallel import limit_torch_threads
+from position_store import merge_stores, STORE_SUFFIX
+
+try:
+    from config import BOARD_SCORES, NUMBER_OF_GAMES
+except ModuleNotFoundError:
+    from .config import BOARD_SCORES, NUMBER_OF_GAMES
+
+# state of a pool worker: players built so far, keyed by their spec
+_worker = {}
+
+
+def play_game(white_p, black_p, board: Board=None, game: ChessGame=None) -> dict:
+    # GameVisualize._game without the display, returns the same result dict
+    board = board.copy() if board else Board()
+    game = game or white_p.game
+    start_time = time()
+    white_time = []
+    black_time = []
+    white_win = False
+
+    try:
+        for i in count():
+            if game.game_over(board, claim_draw=True):
+                white_score = game.eval_board_state(board, True, board_scores_policy=BOARD_SCORES)
+                black_score = game.eval_board_state(board, False, board_scores_policy=BOARD_SCORES)
+                white_win = white_score > black_score
+                break
+
+            if board.turn:
+                tmp_time = time()
+                move = white_p.move(board)
+                white_time.append(time() - tmp_time)
+            else:
+                tmp_time = time()
+                move = black_p.move(board)
+                black_time.append(time() - tmp_time)
+
+            board.push_uci(move)
+    finally:
+        white_p.end_game()
+        black_p.end_game()
+
+    if game.check_tie(board, claim_draw=False):
+        result = -1
+    else:
+        result = int(game.check_win(board, True))
+
+    return {
+        "white": white_p.solver,
+        "black": black_p.solver,
+        "FEN": board.fen(),
+        "last_move": board.peek(),
+        "moves_history": [move.uci() for move in board.move_stack],
+        "moves": i, "time": round(time() - start_time, 2),
+        "black_time": black_time,
+        "white_time": white_time,
+        "white_win": white_win,
+        "result": result
+    }
+
+
+def _worker_player(spec: tuple, color: bool, data_paths: dict):
+    player_class, kwargs = spec
+    key = (player_class, tuple(sorted(kwargs.items())), color)
+    if key not in _worker:
+        bot = player_class(color, **kwargs)
+        # every worker appends to its own file, merged by the parent at the end
+        if getattr(bot, "data_path", None):
+            root, ext = os.path.splitext(bot.data_path)
+            part = f"{root}.worker{os.getpid()}{ext}"
+            data_paths[part] = bot.data_path
+            bot.data_path = part
+        _worker[key] = bot
+
+    return _worker[key]
+
+
+def _play(index: int, seed: int, white: tuple, black: tuple, fen: str=None) -> tuple:
+    import torch
+    random.seed(seed)
+    np.random.seed(seed % 2 ** 32)
+    torch.manual_seed(seed)
+
+    data_paths = _worker.setdefault("data_paths", {})
+    white_p = _worker_player(white, True, data_paths)
+    black_p = _worker_player(black, False, data_paths)
+    # players are reused between games, their tables are not
+    for bot in (white_p, black_p):
+        if getattr(bot, "tt", None) is not None:
+            bot.tt.clear()
+    result = play_game(white_p, black_p, Board(fen) if fen else None)
+
+    return index, result, dict(data_paths)
+
+
+def run_tournament(white: tuple, black: tuple, n: int=NUMBER_OF_GAMES, workers: int=os.cpu_count(),
+                   seed: int=0, swap_colors: bool=False, fen: str=None) -> pd.DataFrame:
+    """Plays n games between two (player class, kwargs) specs over a process pool.
+
+    Game i is seeded with seed + i. With swap_colors the specs change
+    sides every other game. Training rows generated by the workers are
+    appended to the players' data files once every game has finished.
+    """
+    results = {}
+    data_paths = {}
+
+    context = mp.get_context("spawn")
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=limit_torch_threads) as pool:
+        futures = []
+        for i in range(n):
+            white_spec, black_spec = (black, white) if swap_colors and i % 2 else (white, black)
+            futures.append(pool.submit(_play, i, seed + i, white_spec, black_spec, fen))
+
+        for future in as_completed(futures):
+            i, result, paths = future.result()
+            results[i] = result
+            data_paths.update(paths)
+
+    targets = {}
+    for part, path in data_paths.items():
+        targets.setdefault(path, []).append(part)
+    for path, parts in targets.items():
+        merge = merge_stores if path.endswith(STORE_SUFFIX) else merge_files
+        merge(sorted(part for part in parts if os.path.exists(part)), path)
+
+    return pd.DataFrame.from_dict(dict(sorted(results.items())), orient="index")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless self-play tournament")
+    parser.add_argument("--white", default="MiniMaxPlayer", help="player class for white")
+    parser.add_argument("--black", default="MiniMaxPlayer", help="player class for black")
+    parser.add_argument("--depth", type=int, default=None)
+    parser.add_argument("--generate-data", action="store_true")
+    parser.add_argument("--games", type=int, default=NUMBER_OF_GAMES)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--swap-colors", action="store_true")
+    parser.add_argument("--fen", default=None)
+    parser.add_argument("--out", default=None, help="csv file for the results")
+    args = parser.parse_args()
+
+    def spec(name: str) -> tuple:
+        player_class = getattr(players, name)
+        kwargs = {}
+        if issubclass(player_class, players.SearchPlayer):
+            if args.depth is not None:
+                kwargs["depth"] = args.depth
+            if args.generate_data and player_class.data_path is not None:
+                kwargs["generate_data"] = True
+        return player_class, kwargs
+
+    start_time = time()
+    results = run_tournament(spec(args.white), spec(args.black), args.games, args.workers,
+                             args.seed, args.swap_colors, args.fen)
+    elapsed = time() - start_time
+
+    print(results[["white", "black", "moves", "time", "white_win", "result"]])
+    print(f"{args.games} games in {elapsed:.1f}s, {args.games / elapsed * 3600:.0f} games/hour "
+          f"on {args.workers} workers")
+    if args.out:
+        results.to_csv(args.out)
@@ -0,0 +1,128 @@
+import argparse
+import copy
+import os
+import torch
+import torch.nn as nn
+import torch.optim as optim
+
+from time import time
+from torch.nn.functional import l1_loss
+from mlp import FlexibleMLP
+from dataset import RowBatchDataset, split_batches, batch_loader, binary_path, csv_to_binary
+
+try:
+    from config import (DATA, DATA_2, LAYERS_SIZE, LAYERS_SIZE_2, MODEL, MODEL_2, PACKAGE_DIR, BATCH_SIZE, EPOCHS,
+                        PATIENCE, LEARNING_RATE)
+except ModuleNotFoundError:
+    from .config import (DATA, DATA_2, LAYERS_SIZE, LAYERS_SIZE_2, MODEL, MODEL_2, PACKAGE_DIR, BATCH_SIZE, EPOCHS,
+                         PATIENCE, LEARNING_RATE)
+
+# data file, layer sizes and output of the two models loaded by ChessGame
+MODELS = {
+    "h": (DATA, LAYERS_SIZE, MODEL),
+    "h2": (DATA_2, LAYERS_SIZE_2, MODEL_2),
+}
+
+
+def prepare_data(path: str) -> str:
+    # csv files are converted once, and again whenever the csv is newer than its binary file
+    if path.endswith(".csv"):
+        binary = binary_path(path)
+        if not os.path.exists(binary) or os.path.getmtime(binary) < os.path.getmtime(path):
+            csv_to_binary(path, binary)
+        path = binary
+
+    return path
+
+
+def evaluate(model: nn.Module, loader) -> float:
+    # mean absolute error per row
+    model.eval()
+    l1, total = 0.0, 0
+    with torch.inference_mode():
+        for batch_X, batch_y in loader:
+            l1 += l1_loss(model(batch_X).squeeze(-1), batch_y, reduction="sum").item()
+            total += len(batch_y)
+    assert total, "The validation set is empty!"
+
+    return l1 / total
+
+
+def train(model: nn.Module, train_loader, test_loader, epochs: int=EPOCHS, patience: int=PATIENCE,
+          lr: float=LEARNING_RATE, verbose: bool=True) -> dict:
+    """Trains with Adam on L1 loss and keeps the weights of the best validation epoch."""
+    criterion = nn.L1Loss()
+    optimizer = optim.Adam(model.parameters(), lr=lr)
+    best_l1, best_state, best_epoch = float("inf"), None, 0
+    report = {"epochs": 0, "train_time": 0.0, "eval_time": 0.0, "rows": 0}
+
+    for epoch in range(1, epochs + 1):
+        start_time = time()
+        model.train()
+        for batch_X, batch_y in train_loader:
+            loss = criterion(model(batch_X).squeeze(-1), batch_y)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            report["rows"] += len(batch_y)
+        report["train_time"] += time() - start_time
+
+        start_time = time()
+        test_l1 = evaluate(model, test_loader)
+        report["eval_time"] += time() - start_time
+        report["epochs"] = epoch
+
+        if test_l1 < best_l1:
+            best_l1, best_epoch = test_l1, epoch
+            best_state = copy.deepcopy(model.state_dict())
+        if verbose:
+            print(f"Epoch {epoch}/{epochs}, Loss: {loss.item():.4f}, Test L1: {test_l1:.4f}")
+        if epoch - best_epoch >= patience:
+            break
+
+    if best_state is not None:
+        model.load_state_dict(best_state)
+    report.update(best_epoch=best_epoch, test_l1=best_l1)
+
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the FlexibleMLP move-ordering models")
+    parser.add_argument("model", choices=MODELS, help="h: model.pth on DATA, h2: model_2.pth on DATA_2")
+    parser.add_argument("--data", default=None, help="csv or .f32 training rows, defaults to the model's data file")
+    parser.add_argument("--out", default=None, help="defaults to the model's .pth file")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--epochs", type=int, default=EPOCHS)
+    parser.add_argument("--patience", type=int, default=PATIENCE)
+    parser.add_argument("--lr", type=float, default=LEARNING_RATE)
+    parser.add_argument("--test-fraction", type=float, default=0.2)
+    parser.add_argument("--workers", type=int, default=0, help="DataLoader worker processes")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args()
+
+    data, layers, out = MODELS[args.model]
+    torch.manual_seed(args.seed)
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    start_time = time()
+    dataset = RowBatchDataset(prepare_data(args.data or os.path.join(PACKAGE_DIR, data)), args.batch_size)
+    assert dataset.columns == layers[0] + 1, f"{dataset.path} has {dataset.columns} columns, expected {layers[0] + 1}!"
+    train_dataset, test_dataset = split_batches(dataset, args.test_fraction, args.seed)
+    train_loader = batch_loader(train_dataset, shuffle=True, workers=args.workers)
+    test_loader = batch_loader(test_dataset, workers=args.workers)
+    load_time = time() - start_time
+
+    model = FlexibleMLP(layers)
+    report = train(model, train_loader, test_loader, args.epochs, args.patience, args.lr, not args.quiet)
+    torch.save(model.state_dict(), args.out or os.path.join(PACKAGE_DIR, out))
+
+    print(f"rows: {dataset.rows}, batches: {len(train_dataset)} train / {len(test_dataset)} test "
+          f"of {args.batch_size}, data load: {load_time:.2f}s")
+    print(f"epochs: {report['epochs']} (best {report['best_epoch']}), train: {report['train_time']:.2f}s "
+          f"({report['rows'] / report['train_time']:.0f} rows/s), eval: {report['eval_time']:.2f}s, "
+          f"total: {time() - start_time:.2f}s")
+    print(f"Mean Absolute Error Loss (L1) on test data: {report['test_l1']}")
@@ -0,0 +1,158 @@
+import sys
+
+from chess import Board, Move
+from chess.polyglot import zobrist_hash
+from typing import List, Optional, Tuple
+
+try:
+    from config import TT_SIZE_MB
+except ModuleNotFoundError:
+    from .config import TT_SIZE_MB
+
+# bound types of a stored score
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+# key, depth, score, flag, best move, age
+Entry = Tuple[int, int, float, int, Optional[Move], int]
+
+# approximate size of one stored entry: the tuple itself plus its key, score and move objects
+ENTRY_BYTES = (sys.getsizeof((0, 0, 0.0, 0, None, 0)) + sys.getsizeof(2 ** 63)
+               + sys.getsizeof(0.0) + sys.getsizeof(Move(0, 0)))
+
+
+def board_key(board: Board) -> int:
+    return zobrist_hash(board)
+
+
+class TranspositionTable:
+    """Fixed-size, Zobrist-keyed table of search results.
+
+    A slot is overwritten when it is empty, holds the same position, was
+    written during an older search, or holds a shallower result.
+    """
+
+    def __init__(self, size_mb: float=TT_SIZE_MB):
+        self.size = max(1, int(size_mb * 1024 * 1024) // (ENTRY_BYTES + 8))
+        self.slots = [None] * self.size
+        self.filled = 0
+        self.age = 0
+        self.clear_stats()
+
+    def clear_stats(self):
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+        self.replacements = 0
+        self.rejections = 0
+
+    def clear(self):
+        self.slots = [None] * self.size
+        self.filled = 0
+        self.age = 0
+        self.clear_stats()
+
+    def new_search(self):
+        # entries from older searches become the first candidates for replacement
+        self.age += 1
+
+    def get(self, key: int) -> Optional[Entry]:
+        entry = self.slots[key % self.size]
+        if entry is not None and entry[0] == key:
+            return entry
+
+        return None
+
+    def probe(self, key: int) -> Optional[Entry]:
+        self.probes += 1
+        entry = self.get(key)
+        if entry is not None:
+            self.hits += 1
+
+        return entry
+
+    def store(self, key: int, depth: int, score: float, flag: int, move: Optional[Move]):
+        index = key % self.size
+        entry = self.slots[index]
+
+        if entry is None:
+            self.filled += 1
+        else:
+            if entry[0] != key and entry[5] == self.age and entry[1] > depth:
+                self.rejections += 1
+                return
+            if entry[0] != key:
+                self.replacements += 1
+            if move is None and entry[0] == key:
+                # keep the best move found by an earlier search of this position
+                move = entry[4]
+
+        self.slots[index] = (key, depth, score, flag, move, self.age)
+        self.stores += 1
+
+    def hit_rate(self) -> float:
+        return self.hits / self.probes if self.probes else 0.0
+
+    def memory_usage(self) -> int:
+        return sys.getsizeof(self.slots) + self.filled * ENTRY_BYTES
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "filled": self.filled,
+            "usage": round(self.filled / self.size, 4),
+            "probes": self.probes,
+            "hits": self.hits,
+            "hit_rate": round(self.hit_rate(), 4),
+            "stores": self.stores,
+            "replacements": self.replacements,
+            "rejections": self.rejections,
+            "memory_bytes": self.memory_usage(),
+        }
+
+
+def probe_window(entry: Entry, depth: int, alpha: float, beta: float) -> Tuple[Optional[float], float, float]:
+    # returns the stored score when it settles the node, otherwise the (possibly narrowed) window
+    _, entry_depth, score, flag, _, _ = entry
+    if entry_depth < depth:
+        return None, alpha, beta
+
+    if flag == EXACT:
+        return score, alpha, beta
+    if flag == LOWER:
+        alpha = max(alpha, score)
+    else:
+        beta = min(beta, score)
+
+    if alpha >= beta:
+        return score, alpha, beta
+
+    return None, alpha, beta
+
+
+def bound_flag(score: float, alpha: float, beta: float) -> int:
+    if score <= alpha:
+        return UPPER
+    if score >= beta:
+        return LOWER
+
+    return EXACT
+
+
+def principal_variation(table: TranspositionTable, board: Board, max_length: int) -> List[Tuple[int, Move]]:
+    # follows the stored best moves from the given position, returns (key, move) pairs
+    board = board.copy(stack=False)
+    line, seen = [], set()
+
+    while len(line) < max_length:
+        key = board_key(board)
+        entry = table.get(key)
+        if key in seen or entry is None or entry[4] is None or not board.is_legal(entry[4]):
+            break
+
+        seen.add(key)
+        line.append((key, entry[4]))
+        board.push(entry[4])
+
+    return line
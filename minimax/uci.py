@@ -0,0 +1,218 @@
+import sys
+import threading
+import player as players
+
+from math import inf
+from chess import Board
+from book import book_move
+from transposition import board_key
+
+try:
+    from config import DEFAULT_DEPTH, MAX_DEPTH, TT_SIZE_MB, BOOK
+except ModuleNotFoundError:
+    from .config import DEFAULT_DEPTH, MAX_DEPTH, TT_SIZE_MB, BOOK
+
+PLAYERS = ["MiniMaxPlayer", "MiniMaxPlayerWithRegressor", "MiniMaxPlayerWithHFunction",
+           "MiniMaxPlayerWithHFunctionPrediction"]
+
+# moves left assumed when the GUI does not send movestogo, and time kept back for the GUI
+MOVES_TO_GO = 30
+MOVE_OVERHEAD = 0.05
+
+
+def time_budget(params: dict, turn: bool) -> float:
+    # seconds for this move, None when the go command sets no time limit
+    if "movetime" in params:
+        return max(0.0, params["movetime"] / 1000 - MOVE_OVERHEAD)
+
+    remaining = params.get("wtime" if turn else "btime")
+    if remaining is None:
+        return None
+    increment = params.get("winc" if turn else "binc", 0)
+    budget = remaining / params.get("movestogo", MOVES_TO_GO) + 0.8 * increment
+
+    return max(0.0, min(budget, remaining / 2) / 1000 - MOVE_OVERHEAD)
+
+
+class UCIEngine:
+    """UCI front end over a minimax player.
+
+    Searches run on a worker thread so stop, ponderhit and quit are read
+    while the engine thinks. Every search goes through iterative deepening
+    so a stop returns the last complete iteration.
+    """
+
+    def __init__(self, output=print):
+        self.output = output
+        self.options = {"Player": "MiniMaxPlayer", "Depth": DEFAULT_DEPTH, "Hash": TT_SIZE_MB, "OwnBook": True}
+        self.bot = None
+        self.board = Board()
+        self.thread = None
+        # a search started by go infinite or go ponder only reports its move once released
+        self.release = threading.Event()
+        self.search_id = 0
+        self.ponder_params = None
+
+    def player(self):
+        if self.bot is None:
+            player_class = getattr(players, self.options["Player"])
+            self.bot = player_class(True, depth=self.options["Depth"], tt_size=self.options["Hash"],
+                                    book=BOOK if self.options["OwnBook"] else None)
+        return self.bot
+
+    def send(self, line: str):
+        self.output(line)
+
+    def handle(self, line: str) -> bool:
+        # returns False on quit
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, args = tokens[0], tokens[1:]
+
+        if command == "uci":
+            self.send("id name ai-univaq minimax")
+            self.send("id author ai-univaq")
+            self.send(f"option name Player type combo default MiniMaxPlayer {' '.join(f'var {p}' for p in PLAYERS)}")
+            self.send(f"option name Depth type spin default {DEFAULT_DEPTH} min 1 max {MAX_DEPTH}")
+            self.send(f"option name Hash type spin default {TT_SIZE_MB} min 0 max 4096")
+            self.send("option name OwnBook type check default true")
+            self.send("option name Ponder type check default false")
+            self.send("uciok")
+        elif command == "isready":
+            self.player()
+            self.send("readyok")
+        elif command == "setoption":
+            self.setoption(args)
+        elif command == "ucinewgame":
+            self.stop(report=False)
+            if self.bot is not None and self.bot.tt is not None:
+                self.bot.tt.clear()
+        elif command == "position":
+            self.stop(report=False)
+            self.position(args)
+        elif command == "go":
+            self.go(args)
+        elif command == "stop":
+            self.stop()
+        elif command == "ponderhit":
+            self.ponderhit()
+        elif command == "quit":
+            self.stop(report=False)
+            return False
+
+        return True
+
+    def setoption(self, args: list):
+        text = " ".join(args)
+        if not text.startswith("name ") or " value " not in text:
+            return
+        name, value = text[len("name "):].split(" value ", 1)
+        if name == "Player" and value in PLAYERS:
+            self.options[name] = value
+        elif name in ("Depth", "Hash"):
+            self.options[name] = int(value)
+        elif name == "OwnBook":
+            self.options[name] = value.lower() == "true"
+        else:
+            return
+        self.stop(report=False)
+        self.bot = None
+
+    def position(self, args: list):
+        if args[:1] == ["startpos"]:
+            board, rest = Board(), args[1:]
+        elif args[:1] == ["fen"]:
+            fen_end = args.index("moves") if "moves" in args else len(args)
+            board, rest = Board(" ".join(args[1:fen_end])), args[fen_end:]
+        else:
+            return
+        if rest[:1] == ["moves"]:
+            for uci in rest[1:]:
+                board.push_uci(uci)
+        self.board = board
+
+    def go(self, args: list):
+        self.stop(report=False)
+        self.ponder_params = None
+        params, infinite = {}, False
+        i = 0
+        while i < len(args):
+            if args[i] in ("infinite", "ponder"):
+                infinite = True
+                if args[i] == "ponder":
+                    self.ponder_params = params
+                i += 1
+            elif args[i] in ("movetime", "wtime", "btime", "winc", "binc", "movestogo", "depth") and i + 1 < len(args):
+                params[args[i]] = int(args[i + 1])
+                i += 2
+            else:
+                i += 1
+
+        bot = self.player()
+        if not infinite and self.options["OwnBook"]:
+            move = book_move(self.board, bot.book)
+            if move is not None:
+                self.send(f"bestmove {move.uci()}")
+                return
+
+        self.start(params, infinite)
+
+    def start(self, params: dict, infinite: bool):
+        budget = None if infinite else time_budget(params, self.board.turn)
+        max_depth = params.get("depth") or (MAX_DEPTH if infinite or budget is not None else self.options["Depth"])
+        self.search_id += 1
+        self.release.clear()
+        self.thread = threading.Thread(target=self._search, daemon=True, name="uci search",
+                                       args=(self.search_id, self.board.copy(), inf if budget is None else budget,
+                                             max_depth, infinite))
+        self.thread.start()
+
+    def _search(self, search_id: int, board: Board, budget: float, max_depth: int, infinite: bool):
+        engine = self.bot.engine
+        score, move = engine.search(board, max_depth, budget, max_depth=max_depth)
+
+        stats = engine.stats
+        if infinite:
+            self.release.wait()
+        if search_id != self.search_id:
+            return
+
+        self.send(f"info depth {stats.depth} score cp {round(score * 100)} nodes {stats.nodes} "
+                  f"nps {round(stats.nps)} time {round(stats.time * 1000)}" + (f" pv {move.uci()}" if move else ""))
+        if move is None:
+            self.send("bestmove 0000")
+            return
+
+        # the reply stored for the position after our move is the move to ponder on
+        board.push(move)
+        entry = self.bot.tt.get(board_key(board)) if self.bot.tt is not None else None
+        ponder_move = entry[4] if entry is not None and entry[4] is not None and board.is_legal(entry[4]) else None
+        self.send(f"bestmove {move.uci()}" + (f" ponder {ponder_move.uci()}" if ponder_move else ""))
+
+    def stop(self, report: bool=True):
+        # stops the running search, which reports its move unless report is False
+        if self.thread is None:
+            return
+        if not report:
+            self.search_id += 1
+        self.bot.engine.stopped = True
+        self.release.set()
+        self.thread.join()
+        self.bot.engine.stopped = False
+        self.thread = None
+
+    def ponderhit(self):
+        # the expected move was played, search the same position with the time of the go ponder command
+        if self.thread is None or self.ponder_params is None:
+            return
+        params, self.ponder_params = self.ponder_params, None
+        self.stop(report=False)
+        self.start(params, False)
+
+
+if __name__ == "__main__":
+    engine = UCIEngine(lambda line: print(line, flush=True))
+    for line in sys.stdin:
+        if not engine.handle(line.strip()):
+            break